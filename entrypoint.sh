@@ -4,6 +4,7 @@ set -e
 # Apply database migrations
 echo "Applying database migrations..."
 python manage.py migrate
+python manage.py migrate_shards
 
 # Create superuser if env vars are set
 # Create or update superuser
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 
 from pathlib import Path
 import os
+import sys
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -81,10 +82,45 @@ WSGI_APPLICATION = 'mileage_tracker_config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
+DATA_DIR = Path(os.getenv('DATA_DIR', BASE_DIR / 'data' if os.getenv('PROD') == 'True' else BASE_DIR))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'data' / 'db.sqlite3' if os.getenv('PROD') == 'True' else BASE_DIR / 'db.sqlite3',
+        'NAME': DATA_DIR / 'db.sqlite3',
+    }
+}
+
+# Optional per-user sharding: journeys, cars, fuel types and settings are spread
+# over SHARD_COUNT extra SQLite files, while auth and sessions stay on 'default'.
+# 0 disables sharding. See tracker/shards.py.
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0'))
+
+# The test suite exercises sharding on two shards whatever SHARD_COUNT is; the
+# tests that use them turn the router on themselves
+TESTING = sys.argv[1:2] == ['test']
+
+for index in range(max(SHARD_COUNT, 2) if TESTING else SHARD_COUNT):
+    DATABASES[f'shard_{index}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': DATA_DIR / f'shard_{index}.sqlite3',
+        'OPTIONS': {'timeout': 20},
+    }
+
+if SHARD_COUNT:
+    DATABASE_ROUTERS = ['tracker.routers.ShardRouter']
+    MIDDLEWARE.insert(MIDDLEWARE.index('django.contrib.auth.middleware.AuthenticationMiddleware') + 1, 'tracker.middleware.ShardMiddleware')
+
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+
+# Shared by every gunicorn worker, so a journey saved in one worker invalidates
+# the report series cached by the others (see tracker/series.py)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': DATA_DIR / 'cache',
     }
 }
 
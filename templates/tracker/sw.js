@@ -0,0 +1,202 @@
+{% load static %}// Mileage Tracker service worker, rendered by tracker.views.service_worker.
+// Static URLs below carry WhiteNoise manifest hashes, so every deploy that
+// changes an asset also changes this file and triggers a reinstall.
+importScripts('{% static "tracker/js/offline-queue.js" %}');
+
+const SHELL_CACHE = 'mileage-shell';
+const PAGE_CACHE = 'mileage-pages';
+const CDN_CACHE = 'mileage-cdn';
+
+const DASHBOARD_URL = '{% url "dashboard" %}';
+const ADD_JOURNEY_URL = '{% url "add_journey" %}';
+const OFFLINE_URL = '{% url "offline" %}';
+const SYNC_URL = '{% url "sync_journeys" %}';
+const LOGIN_URL = '{% url "login" %}';
+const LOGOUT_URL = '{% url "logout" %}';
+
+// Give up on a hanging network after this long and fall back to the queue/cache
+const NETWORK_TIMEOUT_MS = 8000;
+
+const PRECACHE_URLS = [
+    OFFLINE_URL,
+    '{% static "tracker/js/offline-queue.js" %}',
+    '{% static "tracker/js/pwa.js" %}',
+    '{% static "tracker/js/reports-chart.js" %}',
+    '{% static "tracker/icons/icon.svg" %}',
+    '{% static "tracker/icons/icon-192.png" %}',
+    '{% static "tracker/icons/icon-512.png" %}',
+];
+
+// Third-party shell assets; fetched no-cors so they are stored as opaque responses
+const CDN_URLS = [
+    'https://cdn.tailwindcss.com?plugins=forms,typography,aspect-ratio,container-queries',
+    'https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap',
+    'https://fonts.googleapis.com/css2?family=Material+Symbols+Outlined:wght,FILL@100..700,0..1&display=swap',
+];
+const CDN_HOSTS = ['cdn.tailwindcss.com', 'fonts.googleapis.com', 'fonts.gstatic.com'];
+
+self.addEventListener('install', function (event) {
+    event.waitUntil(Promise.all([
+        caches.open(SHELL_CACHE).then(function (cache) { return cache.addAll(PRECACHE_URLS); }),
+        // The add form is what drivers need most without signal
+        fetch(ADD_JOURNEY_URL, { credentials: 'same-origin' })
+            .then(function (response) { return storePage(ADD_JOURNEY_URL, response); })
+            .catch(function () {}),
+        caches.open(CDN_CACHE).then(function (cache) {
+            return Promise.all(CDN_URLS.map(function (url) {
+                return fetch(new Request(url, { mode: 'no-cors' }))
+                    .then(function (response) { return cache.put(url, response); })
+                    .catch(function () { /* best effort, filled at runtime */ });
+            }));
+        }),
+    ]).then(function () { return self.skipWaiting(); }));
+});
+
+self.addEventListener('activate', function (event) {
+    // Drop shell entries left behind by previous deploys
+    event.waitUntil(caches.open(SHELL_CACHE).then(function (cache) {
+        const current = PRECACHE_URLS.map(function (url) { return new URL(url, self.location).href; });
+        return cache.keys().then(function (requests) {
+            return Promise.all(requests
+                .filter(function (request) { return current.indexOf(request.url) === -1; })
+                .map(function (request) { return cache.delete(request); }));
+        });
+    }).then(function () { return self.clients.claim(); }));
+});
+
+function withTimeout(promise) {
+    return new Promise(function (resolve, reject) {
+        const timer = setTimeout(function () { reject(new Error('timeout')); }, NETWORK_TIMEOUT_MS);
+        promise.then(function (value) { clearTimeout(timer); resolve(value); },
+                     function (error) { clearTimeout(timer); reject(error); });
+    });
+}
+
+// Authenticated pages are only cached when served directly; a redirect to the
+// login page means the session ended, so cached private pages are discarded.
+function storePage(key, response) {
+    if (response.redirected && new URL(response.url).pathname.indexOf(LOGIN_URL) === 0) {
+        caches.delete(PAGE_CACHE);
+    } else if (response.ok && !response.redirected) {
+        const copy = response.clone();
+        caches.open(PAGE_CACHE).then(function (cache) { cache.put(key, copy); });
+    }
+    return response;
+}
+
+function offlineFallback(key) {
+    return caches.match(key, { cacheName: PAGE_CACHE }).then(function (cached) {
+        return cached || caches.match(OFFLINE_URL, { cacheName: SHELL_CACHE });
+    });
+}
+
+// The dashboard is keyed without its query string so "?queued=1" still hits
+function dashboard(request) {
+    return caches.match(DASHBOARD_URL, { cacheName: PAGE_CACHE }).then(function (cached) {
+        const network = fetch(request).then(function (response) { return storePage(DASHBOARD_URL, response); });
+        if (cached) {
+            network.catch(function () { /* keep serving the cached copy */ });
+            return cached;
+        }
+        return network.catch(function () { return offlineFallback(DASHBOARD_URL); });
+    });
+}
+
+function cdnAsset(request) {
+    return caches.open(CDN_CACHE).then(function (cache) {
+        return cache.match(request).then(function (cached) {
+            const network = fetch(request).then(function (response) {
+                cache.put(request, response.clone());
+                return response;
+            });
+            if (cached) {
+                network.catch(function () {});
+                return cached;
+            }
+            return network;
+        });
+    });
+}
+
+function networkFirst(request) {
+    return withTimeout(fetch(request))
+        .then(function (response) { return storePage(request, response); })
+        .catch(function () { return offlineFallback(request); });
+}
+
+function cacheFirst(request, cacheName) {
+    return caches.match(request).then(function (cached) {
+        return cached || fetch(request).then(function (response) {
+            const copy = response.clone();
+            caches.open(cacheName).then(function (cache) { cache.put(request, copy); });
+            return response;
+        });
+    });
+}
+
+// Any write makes the cached dashboard totals stale
+function invalidateDashboard(response) {
+    return caches.open(PAGE_CACHE)
+        .then(function (cache) { return cache.delete(DASHBOARD_URL); })
+        .then(function () { return response; });
+}
+
+// A journey POST that cannot reach the server is queued and replayed later.
+// The form carries a client_uuid, so if the original request did get through
+// before the connection dropped, the replay is recognised as a duplicate.
+function submitJourney(request) {
+    const queued = request.clone();
+    return withTimeout(fetch(request)).then(invalidateDashboard, function () {
+        return queued.formData().then(function (formData) {
+            const entry = {};
+            formData.forEach(function (value, key) { entry[key] = value; });
+            const csrfToken = entry.csrfmiddlewaretoken;
+            delete entry.csrfmiddlewaretoken;
+            return JourneyQueue.enqueue(entry, csrfToken);
+        }).then(function () {
+            if (self.registration.sync) {
+                self.registration.sync.register(JourneyQueue.SYNC_TAG).catch(function () {});
+            }
+            return Response.redirect(DASHBOARD_URL + '?queued=1', 303);
+        });
+    });
+}
+
+self.addEventListener('fetch', function (event) {
+    const request = event.request;
+    const url = new URL(request.url);
+
+    if (url.origin === self.location.origin) {
+        if (request.method === 'POST' && url.pathname === ADD_JOURNEY_URL) {
+            event.respondWith(submitJourney(request));
+            return;
+        }
+        if (request.method !== 'GET') {
+            if (request.mode === 'navigate' && (url.pathname === LOGOUT_URL || url.pathname === LOGIN_URL)) {
+                // The next person on this device must never see the last one's pages
+                event.respondWith(caches.delete(PAGE_CACHE).then(function () { return fetch(request); }));
+            } else if (request.mode === 'navigate') {
+                event.respondWith(fetch(request).then(invalidateDashboard));
+            }
+            return;
+        }
+        if (url.pathname.indexOf('/admin/') === 0) {
+            return;
+        }
+        if (url.pathname.indexOf('{% get_static_prefix %}') === 0) {
+            event.respondWith(cacheFirst(request, SHELL_CACHE));
+        } else if (request.mode === 'navigate' && url.pathname === DASHBOARD_URL) {
+            event.respondWith(dashboard(request));
+        } else if (request.mode === 'navigate') {
+            event.respondWith(networkFirst(request));
+        }
+    } else if (request.method === 'GET' && CDN_HOSTS.indexOf(url.hostname) !== -1) {
+        event.respondWith(cdnAsset(request));
+    }
+});
+
+self.addEventListener('sync', function (event) {
+    if (event.tag === JourneyQueue.SYNC_TAG) {
+        event.waitUntil(JourneyQueue.flush(SYNC_URL).then(invalidateDashboard));
+    }
+});
@@ -1,3 +1,163 @@
-from django.contrib import admin
+import datetime
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.auth.models import User
+from django.core.paginator import Paginator
+from django.db.models import F, Max, Min, OuterRef, Subquery
+from django.db.models.functions import Round
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _, ngettext
+from . import series, shards
+from .models import Journey, Settings, FuelType, Car, ShardAssignment
 
-# Register your models here.
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never runs a full COUNT(*) over large tables.
+
+    An unfiltered changelist is sized from the highest primary key, which is a
+    single index lookup. Filtered changelists count at most COUNT_LIMIT rows,
+    so a broad filter costs a bounded scan rather than one over the whole table.
+    """
+    COUNT_LIMIT = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = queryset.model._default_manager.using(queryset.db).aggregate(last=Max('pk'))['last']
+            return estimate or 0
+        return queryset.order_by()[:self.COUNT_LIMIT].count()
+
+class ShardedChangeList(ChangeList):
+    """
+    Loads the users shown on a sharded changelist page in one query.
+
+    select_related('user') cannot join from a shard to 'default', and without
+    it every row would fetch its user separately.
+    """
+
+    def get_results(self, request):
+        super().get_results(request)
+        user_field = self.model._meta.get_field('user')
+        users = User.objects.in_bulk({obj.user_id for obj in self.result_list if obj.user_id})
+        for obj in self.result_list:
+            if obj.user_id in users:
+                user_field.set_cached_value(obj, users[obj.user_id])
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+    # Primary key order walks the table's own index, never a sort
+    ordering = ('-pk',)
+    raw_id_fields = ('user',)
+
+    def sharded(self):
+        return shards.enabled() and shards.is_sharded(self.model)
+
+    def get_changelist(self, request, **kwargs):
+        return ShardedChangeList if self.sharded() else super().get_changelist(request, **kwargs)
+
+    def get_list_select_related(self, request):
+        # Users live on 'default', which a shard query cannot join to
+        select_related = super().get_list_select_related(request)
+        if self.sharded() and select_related:
+            return tuple(field for field in select_related if field != 'user')
+        return select_related
+
+    def get_search_results(self, request, queryset, search_term):
+        if self.sharded() and '=user__username' in self.search_fields and search_term:
+            user_ids = list(User.objects.filter(username=search_term.strip()).values_list('pk', flat=True))
+            return queryset.filter(user_id__in=user_ids), False
+        return super().get_search_results(request, queryset, search_term)
+
+class YearListFilter(admin.SimpleListFilter):
+    """
+    Year drill-down for large tables, replacing date_hierarchy.
+
+    date_hierarchy lists the years with SELECT DISTINCT over a date function,
+    which SQLite evaluates row by row. Here the range comes from MIN and MAX,
+    each a single lookup on the date index, and a year filters as a range.
+    """
+    title = _("year")
+    parameter_name = 'year'
+    field_name = 'date'
+
+    def lookups(self, request, model_admin):
+        queryset = model_admin.get_queryset(request).order_by()
+        # Separate queries, since SQLite only optimises a lone MIN or MAX
+        first = queryset.aggregate(value=Min(self.field_name))['value']
+        last = queryset.aggregate(value=Max(self.field_name))['value']
+        if first is None:
+            return []
+        return [(str(year), str(year)) for year in range(last.year, first.year - 1, -1)]
+
+    def queryset(self, request, queryset):
+        try:
+            year = int(self.value())
+            start, end = datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)
+        except (TypeError, ValueError):
+            return queryset
+        return queryset.filter(**{f'{self.field_name}__gte': start, f'{self.field_name}__lt': end})
+
+@admin.register(FuelType)
+class FuelTypeAdmin(LargeTableAdmin):
+    list_display = ('name', 'user', 'cost_per_unit', 'unit_name', 'efficiency')
+    list_select_related = ('user',)
+    search_fields = ('name',)
+
+@admin.register(Car)
+class CarAdmin(LargeTableAdmin):
+    list_display = ('name', 'make', 'model', 'user', 'fuel_type')
+    list_select_related = ('user', 'fuel_type')
+    search_fields = ('name', 'make', 'model')
+    autocomplete_fields = ('fuel_type',)
+
+@admin.register(Settings)
+class SettingsAdmin(LargeTableAdmin):
+    list_display = ('user', 'currency', 'default_fuel_type')
+    list_select_related = ('user', 'default_fuel_type')
+    search_fields = ('=user__username',)
+    autocomplete_fields = ('default_fuel_type',)
+
+@admin.register(Journey)
+class JourneyAdmin(LargeTableAdmin):
+    list_display = ('date', 'user', 'car', 'reason', 'distance', 'fuel_type', 'total_cost')
+    list_select_related = ('user', 'car')
+    # Served by the journey_date_idx index
+    list_filter = (YearListFilter,)
+    ordering = ('-date',)
+    search_fields = ('=user__username',)
+    search_help_text = _("Exact username")
+    autocomplete_fields = ('car', 'fuel_type_ref')
+    readonly_fields = ('created_at', 'client_uuid')
+    actions = ['recompute_totals']
+
+    @admin.action(description=_("Recompute totals from current fuel price"), permissions=['change'])
+    def recompute_totals(self, request, queryset):
+        # One set-based UPDATE, however many journeys are selected
+        current_price = Subquery(
+            FuelType.objects.filter(pk=OuterRef('fuel_type_ref')).values('cost_per_unit')[:1]
+        )
+        queryset = queryset.filter(fuel_type_ref__isnull=False)
+        # update() sends no signals, so the owners' cached series are dropped here
+        user_ids = set(queryset.order_by().values_list('user_id', flat=True).distinct())
+        updated = queryset.update(
+            cost_per_liter=current_price,
+            total_cost=Round(F('fuel_quantity') * current_price, 2),
+        )
+        for user_id in user_ids - {None}:
+            series.invalidate(user_id)
+        self.message_user(request, ngettext(
+            "%(count)d journey was updated.",
+            "%(count)d journeys were updated.",
+            updated,
+        ) % {'count': updated}, messages.SUCCESS)
+
+@admin.register(ShardAssignment)
+class ShardAssignmentAdmin(LargeTableAdmin):
+    list_display = ('user', 'shard', 'moving')
+    list_select_related = ('user',)
+    search_fields = ('=user__username',)
+    # Moves go through rebalance_shards, which also copies the data
+    readonly_fields = ('shard', 'moving')
@@ -1,5 +1,8 @@
+from decimal import Decimal
 from django import forms
+from django.utils import timezone
 from .models import Journey, Settings, FuelType, Car
+from .tracks import parse_track
 
 class JourneyForm(forms.ModelForm):
     # Override fuel_type to be a ModelChoiceField selection, but we will save it manually to the ref & char fields
@@ -44,8 +47,9 @@ class JourneyForm(forms.ModelForm):
         cost_per = cleaned_data.get('cost_per_liter')
         total = cleaned_data.get('total_cost')
 
-        # Auto-calculate Quantity if missing
-        if distance and fuel_type and not qty:
+        # Auto-calculate Quantity if missing. Compare with None, since a short
+        # track can round to a quantity of 0 that still needs a cost.
+        if distance is not None and fuel_type and qty is None:
             try:
                 efficiency = fuel_type.efficiency
                 if efficiency > 0:
@@ -56,12 +60,12 @@ class JourneyForm(forms.ModelForm):
                 pass 
         
         # Auto-calculate Total Cost if missing
-        if qty and not total:
+        if qty is not None and total is None:
             if not cost_per and fuel_type:
                  cost_per = fuel_type.cost_per_unit
                  cleaned_data['cost_per_liter'] = cost_per
             
-            if cost_per:
+            if cost_per is not None:
                 total = qty * cost_per
                 total = round(total, 2)
                 cleaned_data['total_cost'] = total
@@ -121,3 +125,43 @@ class CarForm(forms.ModelForm):
              'model': forms.TextInput(attrs={'class': 'form-input w-full rounded-lg border-slate-200 dark:border-white/10 bg-background-light dark:bg-background-dark text-slate-900 dark:text-white focus:border-primary focus:ring-primary py-2.5'}),
              'fuel_type': forms.Select(attrs={'class': 'form-select w-full rounded-lg border-slate-200 dark:border-white/10 bg-background-light dark:bg-background-dark text-slate-900 dark:text-white focus:border-primary focus:ring-primary py-2.5'}),
         }
+
+class TrackImportForm(JourneyForm):
+    """
+    JourneyForm whose distance (and, if left blank, date) comes from an
+    uploaded GPX/CSV track instead of being typed in.
+    """
+    track = forms.FileField(
+        label="GPS Track",
+        help_text="GPX or CSV file with latitude/longitude columns",
+        widget=forms.ClearableFileInput(attrs={'accept': '.gpx,.csv', 'class': 'block w-full text-sm text-slate-500 dark:text-slate-400 file:mr-3 file:rounded-lg file:border-0 file:bg-primary file:px-4 file:py-2 file:font-bold file:text-background-dark'})
+    )
+
+    def __init__(self, user, *args, **kwargs):
+        super().__init__(user, *args, **kwargs)
+        self.fields['distance'].required = False
+        self.fields['date'].required = False
+        self.track_summary = None
+
+    def clean_track(self):
+        track = self.cleaned_data['track']
+        try:
+            self.track_summary = parse_track(track)
+        except ValueError as e:
+            raise forms.ValidationError(str(e))
+        return track
+
+    def clean(self):
+        summary = self.track_summary
+        if summary is not None:
+            # Fill these in before JourneyForm derives quantity and cost from them
+            self.cleaned_data['distance'] = Decimal(summary.distance).quantize(Decimal('0.01'))
+            if not self.cleaned_data.get('date'):
+                started = summary.started_at
+                if started is None:
+                    self.cleaned_data['date'] = timezone.now().date()
+                elif timezone.is_aware(started):
+                    self.cleaned_data['date'] = timezone.localdate(started)
+                else:
+                    self.cleaned_data['date'] = started.date()
+        return super().clean()
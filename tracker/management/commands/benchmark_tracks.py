@@ -0,0 +1,87 @@
+import math
+import tempfile
+import time
+import tracemalloc
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from tracker import tracks
+
+GPX_HEADER = (
+    b'<?xml version="1.0" encoding="UTF-8"?>\n'
+    b'<gpx version="1.1" creator="benchmark" xmlns="http://www.topografix.com/GPX/1/1">\n'
+    b'<trk><trkseg>\n'
+)
+GPX_FOOTER = b'</trkseg></trk>\n</gpx>\n'
+
+
+def write_gpx(stream, points):
+    """Write a synthetic drive of `points` fixes, one per second at ~50 km/h with GPS noise."""
+    stream.write(GPX_HEADER)
+    lat, lon = 45.0, 9.0
+    for i in range(points):
+        heading = i / 2000.0
+        noise = 0.00002 * math.sin(i * 12.9898)
+        lat += 0.000125 * math.cos(heading) + noise
+        lon += 0.000177 * math.sin(heading) - noise
+        stream.write(
+            b'<trkpt lat="%.7f" lon="%.7f"><ele>120.0</ele>'
+            b'<time>2026-01-01T08:%02d:%02dZ</time></trkpt>\n' % (lat, lon, (i // 60) % 60, i % 60)
+        )
+    stream.write(GPX_FOOTER)
+
+
+def write_csv(stream, points):
+    stream.write(b'time,lat,lon\n')
+    lat, lon = 45.0, 9.0
+    for i in range(points):
+        heading = i / 2000.0
+        lat += 0.000125 * math.cos(heading)
+        lon += 0.000177 * math.sin(heading)
+        stream.write(b'2026-01-01T08:%02d:%02dZ,%.7f,%.7f\n' % ((i // 60) % 60, i % 60, lat, lon))
+
+
+class Command(BaseCommand):
+    help = "Time GPX/CSV track parsing and distance computation on synthetic tracks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=100000, help="Points per synthetic track")
+        parser.add_argument('--repeat', type=int, default=3, help="Runs per case; the best time is reported")
+
+    def handle(self, *args, **options):
+        points = options['points']
+        backends = [('python', False)]
+        if tracks.np is not None:
+            backends.insert(0, ('numpy', True))
+        else:
+            self.stdout.write("NumPy not installed, benchmarking the pure-Python fallback only")
+
+        for fmt, writer in (('gpx', write_gpx), ('csv', write_csv)):
+            with tempfile.NamedTemporaryFile(suffix=f'.{fmt}') as handle:
+                writer(handle, points)
+                handle.flush()
+                size_mb = handle.tell() / 1024 / 1024
+
+                for backend, vectorized in backends:
+                    def run():
+                        handle.seek(0)
+                        return tracks.parse_track(File(handle, name=f'track.{fmt}'), vectorized=vectorized)
+
+                    best = None
+                    for _ in range(options['repeat']):
+                        started = time.perf_counter()
+                        summary = run()
+                        distance = summary.distance
+                        elapsed = time.perf_counter() - started
+                        best = elapsed if best is None else min(best, elapsed)
+
+                    # Memory is measured on a separate run; tracing skews the timings
+                    tracemalloc.start()
+                    run().distance
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+
+                    self.stdout.write(
+                        f"{fmt:>3} {backend:>6}: {points} points ({size_mb:.1f} MB), "
+                        f"{summary.kept_points} kept, {distance:.2f} km in {best * 1000:.0f} ms "
+                        f"({points / best / 1000:.0f}k points/s), peak {peak / 1024:.0f} KiB"
+                    )
@@ -0,0 +1,68 @@
+from pathlib import Path
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from tracker.forms import TrackImportForm
+from tracker.models import Settings, FuelType, Car
+from tracker.shards import use_shard
+
+
+class Command(BaseCommand):
+    help = "Create a journey from a GPX or CSV GPS track"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Path to a .gpx or .csv track")
+        parser.add_argument('--user', required=True, help="Username the journey belongs to")
+        parser.add_argument('--reason', help="Journey reason (defaults to the file name)")
+        parser.add_argument('--fuel-type', help="Fuel type name (defaults to the user's default fuel type)")
+        parser.add_argument('--car', help="Car name")
+        parser.add_argument('--date', help="Journey date, YYYY-MM-DD (defaults to the track's first timestamp)")
+        parser.add_argument('--cost-per-unit', help="Fuel cost per unit (defaults to the fuel type's current cost)")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['user']}' does not exist")
+
+        with use_shard(user):
+            self.import_track(user, Path(options['path']), options)
+
+    def import_track(self, user, path, options):
+        if options['fuel_type']:
+            fuel = FuelType.objects.filter(user=user, name=options['fuel_type']).first()
+        else:
+            settings = Settings.objects.filter(user=user).select_related('default_fuel_type').first()
+            fuel = settings.default_fuel_type if settings else None
+        if fuel is None:
+            raise CommandError("No fuel type found; pass --fuel-type")
+
+        data = {
+            'fuel_type_select': fuel.pk,
+            'reason': options['reason'] or path.stem,
+            'date': options['date'] or '',
+            'cost_per_liter': options['cost_per_unit'] or '',
+        }
+        if options['car']:
+            car = Car.objects.filter(user=user, name=options['car']).first()
+            if car is None:
+                raise CommandError(f"Car '{options['car']}' does not exist")
+            data['car'] = car.pk
+
+        try:
+            track = open(path, 'rb')
+        except OSError as e:
+            raise CommandError(str(e))
+        with track:
+            form = TrackImportForm(user, data, {'track': File(track, name=path.name)})
+            if not form.is_valid():
+                raise CommandError(form.errors.as_text())
+            journey = form.save(commit=False)
+            journey.user = user
+            journey.save()
+
+        summary = form.track_summary
+        self.stdout.write(self.style.SUCCESS(
+            f"Created journey {journey.pk}: {journey.distance} km from {summary.points} points "
+            f"({summary.kept_points} kept), total cost {journey.total_cost}"
+        ))
@@ -0,0 +1,154 @@
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections, transaction
+from django.db.models import Sum
+from tracker import shards
+from tracker.models import Journey, ShardAssignment
+
+USERNAME = 'loadtest_{}'
+# Head start for worker processes to boot Django before the timed run
+STARTUP_SECONDS = 3
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure concurrent journey write throughput for several shard counts. "
+        "Each run uses a throwaway DATA_DIR and one process per simulated user. "
+        "Every transaction writes several journeys with synchronous=FULL and the "
+        "time spent waiting for the SQLite write lock is reported. Sharding only "
+        "helps when commits are slow; with fast storage the CPU is the limit."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', default='1,2,4', help="Comma-separated shard counts to compare")
+        parser.add_argument('--workers', type=int, default=8, help="Concurrent writer processes (one user each)")
+        parser.add_argument('--transactions', type=int, default=50, help="Write transactions per worker")
+        parser.add_argument('--statements', type=int, default=10, help="Journeys inserted per transaction")
+        parser.add_argument(
+            '--hold-ms', type=float, default=0,
+            help="Sleep this long inside each transaction to simulate slow commits. "
+                 "Results with it are not measurements of the app's own writes.",
+        )
+        parser.add_argument('--tmp-dir', help="Where the throwaway databases are created (defaults to the system temp dir)")
+        # Internal modes used by the child processes
+        parser.add_argument('--setup', action='store_true', help=argparse.SUPPRESS)
+        parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+        parser.add_argument('--start-at', type=float, help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['setup']:
+            return self.setup_users(options['workers'])
+        if options['worker'] is not None:
+            return self.run_worker(options)
+
+        try:
+            counts = [int(count) for count in options['shards'].split(',')]
+        except ValueError:
+            raise CommandError("--shards must be a comma-separated list of integers")
+        if any(count < 1 for count in counts):
+            raise CommandError("Shard counts must be at least 1")
+
+        writes = options['workers'] * options['transactions'] * options['statements']
+        self.stdout.write(
+            f"{options['workers']} workers x {options['transactions']} transactions x {options['statements']} "
+            f"journeys, {os.cpu_count()} CPU(s)"
+        )
+        if options['hold_ms']:
+            self.stdout.write(f"Simulated slow commits: each transaction sleeps {options['hold_ms']:g} ms holding the lock")
+        baseline = None
+        for count in counts:
+            elapsed, results = self.run(count, options)
+            rate = writes / elapsed
+            baseline = baseline or rate
+            busy = sum(result['busy'] for result in results)
+            lock_wait = sum(result['lock_wait'] for result in results)
+            self.stdout.write(
+                f"{count} shard(s): {rate:.0f} writes/s ({rate / baseline:.2f}x), "
+                f"{lock_wait / busy:.0%} of worker time waiting for the write lock, "
+                f"{sum(result['errors'] for result in results)} lock timeouts"
+            )
+
+    def manage(self, env, *args):
+        command = [sys.executable, str(settings.BASE_DIR / 'manage.py'), *args]
+        return subprocess.Popen(command, env=env, stdout=subprocess.PIPE)
+
+    def run(self, count, options):
+        workers = options['workers']
+        with tempfile.TemporaryDirectory(dir=options['tmp_dir']) as data_dir:
+            env = dict(os.environ, DATA_DIR=data_dir, SHARD_COUNT=str(count))
+            for step in (['migrate', '-v0'], ['migrate_shards', '-v0'], ['loadtest_shards', '--setup', '--workers', str(workers)]):
+                process = self.manage(env, *step)
+                process.communicate()
+                if process.returncode:
+                    raise CommandError(f"'{' '.join(step)}' failed")
+
+            start_at = time.time() + STARTUP_SECONDS
+            processes = [
+                self.manage(
+                    env, 'loadtest_shards', '--worker', str(index), '--start-at', str(start_at),
+                    '--transactions', str(options['transactions']), '--statements', str(options['statements']),
+                    '--hold-ms', str(options['hold_ms']),
+                )
+                for index in range(workers)
+            ]
+            results = []
+            for process in processes:
+                output, _ = process.communicate()
+                if process.returncode:
+                    raise CommandError("A load test worker failed")
+                results.append(json.loads(output.decode().strip().splitlines()[-1]))
+
+        return max(result['end'] for result in results) - start_at, results
+
+    def setup_users(self, workers):
+        # Spread users evenly instead of by hash, so every shard gets the same load
+        for index in range(workers):
+            user = User.objects.create_user(USERNAME.format(index))
+            ShardAssignment.objects.create(user=user, shard=index % settings.SHARD_COUNT)
+
+    def run_worker(self, options):
+        user = User.objects.get(username=USERNAME.format(options['worker']))
+        today = datetime.date.today()
+        hold = options['hold_ms'] / 1000
+        lock_wait = 0.0
+        errors = 0
+        with shards.use_shard(user):
+            db = shards.current_db()
+            with connections[db].cursor() as cursor:
+                # SQLite's default, set explicitly: every commit is fsynced
+                cursor.execute('PRAGMA synchronous=FULL')
+            time.sleep(max(0, options['start_at'] - time.time()))
+            started = time.time()
+            for _ in range(options['transactions']):
+                while True:
+                    try:
+                        with transaction.atomic(using=db):
+                            # The first write of a transaction is where SQLite takes the write lock
+                            waited_from = time.perf_counter()
+                            journeys = [self.create_journey(user, today)]
+                            lock_wait += time.perf_counter() - waited_from
+                            journeys += [self.create_journey(user, today) for _ in range(options['statements'] - 1)]
+                            Journey.objects.filter(user=user).aggregate(Sum('distance'))
+                            if hold:
+                                time.sleep(hold)
+                        break
+                    except OperationalError:
+                        # Gave up waiting for the write lock; the transaction rolled back
+                        errors += 1
+        end = time.time()
+        self.stdout.write(json.dumps({'end': end, 'busy': end - started, 'lock_wait': lock_wait, 'errors': errors}))
+
+    def create_journey(self, user, today):
+        return Journey.objects.create(
+            user=user, date=today, distance=10, reason='Load test', fuel_type='Petrol',
+            cost_per_liter=2, fuel_quantity=1, total_cost=2,
+        )
@@ -0,0 +1,16 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from tracker import shards
+
+
+class Command(BaseCommand):
+    help = "Apply migrations to every shard database (run after 'migrate')"
+
+    def handle(self, *args, **options):
+        if not shards.enabled():
+            self.stdout.write("Sharding is disabled (SHARD_COUNT=0), nothing to do")
+            return
+        for db in shards.aliases():
+            self.stdout.write(f"Migrating {db}...")
+            # ShardRouter.allow_migrate limits shards to the tracker tables
+            call_command('migrate', database=db, interactive=False, verbosity=options['verbosity'])
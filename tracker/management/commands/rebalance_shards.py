@@ -0,0 +1,209 @@
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from tracker import shards
+from tracker.models import Journey, Car, Settings, FuelType, ShardAssignment
+from tracker.signals import bulk_changes
+
+# Journeys copied per INSERT
+BATCH_SIZE = 2000
+# Quiet period after a source lock is released before it is checked for
+# writes that were queued behind the lock
+SETTLE_SECONDS = 2
+
+
+class Command(BaseCommand):
+    help = "Move users' journeys, cars, fuel types and settings between shard databases"
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help="Users to move")
+        parser.add_argument('--all', action='store_true', help="Move every user")
+        parser.add_argument('--to', type=int, help="Target shard index (defaults to the user's hashed shard)")
+        parser.add_argument(
+            '--from-default', action='store_true',
+            help="Read from the tracker tables on the default database, i.e. data written before sharding was enabled",
+        )
+        parser.add_argument(
+            '--from-count', type=int,
+            help="SHARD_COUNT before it was lowered, so users on the removed shards can be moved off them",
+        )
+
+    def handle(self, *args, **options):
+        if not shards.enabled():
+            raise CommandError("Sharding is disabled; set SHARD_COUNT first")
+        if options['to'] is not None and not 0 <= options['to'] < len(shards.aliases()):
+            raise CommandError(f"--to must be between 0 and {len(shards.aliases()) - 1}")
+
+        retired = shards.retired_in_use()
+        if options['from_count'] is not None:
+            if retired and options['from_count'] <= retired[-1]:
+                raise CommandError(f"Users are assigned to shard {retired[-1]}; --from-count must be above it")
+            shards.configure_retired(options['from_count'])
+        elif retired:
+            raise CommandError(
+                f"Users are assigned to shard(s) {', '.join(map(str, retired))}, beyond SHARD_COUNT={settings.SHARD_COUNT}. "
+                f"Pass --from-count {retired[-1] + 1} to move them."
+            )
+
+        if options['all']:
+            users = User.objects.order_by('pk')
+        elif options['usernames']:
+            users = User.objects.filter(username__in=options['usernames']).order_by('pk')
+            missing = set(options['usernames']) - set(users.values_list('username', flat=True))
+            if missing:
+                raise CommandError(f"Unknown users: {', '.join(sorted(missing))}")
+        else:
+            raise CommandError("Pass usernames or --all")
+
+        moved = []
+        for user in users.iterator():
+            assignment = shards.get_assignment(user.pk)
+            live = shards.alias(assignment.shard)
+            target_index = options['to'] if options['to'] is not None else shards.hashed_shard(user.pk)
+            target = shards.alias(target_index)
+            if options['from_default']:
+                if live != target and self.has_data(user.pk, live) and self.has_data(user.pk, 'default'):
+                    # Bring the rows written since sharding along first, so the
+                    # legacy rows are merged into them rather than left behind
+                    moved.append(self.move(user, assignment, live, target_index))
+                source = 'default'
+            else:
+                source = live
+            if source == target:
+                continue
+            if not self.has_data(user.pk, source):
+                if assignment.shard != target_index and not options['from_default']:
+                    # Nothing to copy, but the assignment may point at a removed shard
+                    ShardAssignment.objects.filter(pk=assignment.pk).update(shard=target_index)
+                continue
+            moved.append(self.move(user, assignment, source, target_index))
+
+        self.sweep(moved)
+
+    def move(self, user, assignment, source, target_index):
+        target = shards.alias(target_index)
+        ShardAssignment.objects.filter(pk=assignment.pk).update(moving=True)
+        try:
+            with bulk_changes(user.pk):
+                copied = self.move_user(assignment, source, target_index)
+        finally:
+            ShardAssignment.objects.filter(pk=assignment.pk).update(moving=False)
+        self.stdout.write(f"{user.username}: {source} -> {target} ({copied} journeys)")
+        return user.pk, source, target
+
+    def has_data(self, user_id, db):
+        return any(
+            model.objects.using(db).filter(user_id=user_id).exists()
+            for model in (Journey, Car, Settings, FuelType)
+        )
+
+    def lock(self, db):
+        """
+        Take SQLite's write lock on `db` for the rest of the transaction.
+
+        Requests that were already past ShardMiddleware when the user was
+        flagged as moving wait here (or time out) instead of writing rows
+        the copy would miss.
+        """
+        with connections[db].cursor() as cursor:
+            cursor.execute(f"UPDATE {connections[db].ops.quote_name(Journey._meta.db_table)} SET id = id WHERE 0")
+
+    def move_user(self, assignment, source, target_index):
+        user_id = assignment.user_id
+        target = shards.alias(target_index)
+        # Copy and delete under one lock on the source, so nothing can be
+        # written there in between
+        with transaction.atomic(using=source):
+            self.lock(source)
+            # Anything already on the user's live shard is real data to merge
+            # into; anywhere else it is left over from an interrupted move
+            copied = self.copy_user(user_id, source, target, clear_target=target_index != assignment.shard)
+            # Switch before the source rows go, so a failure in between
+            # leaves a recoverable duplicate rather than nothing
+            ShardAssignment.objects.filter(pk=assignment.pk).update(shard=target_index)
+            assignment.shard = target_index
+            self.delete_user(user_id, source)
+        return copied
+
+    def sweep(self, moved):
+        """
+        Merge writes that reached a source after its user was moved.
+
+        Requests queued behind the source lock write there as soon as it is
+        released. The target is live by then, so they are copied over until
+        every source has stayed empty for SETTLE_SECONDS.
+        """
+        while moved:
+            time.sleep(SETTLE_SECONDS)
+            moved = [(user_id, source, target) for user_id, source, target in moved if self.has_data(user_id, source)]
+            for user_id, source, target in moved:
+                with bulk_changes(user_id), transaction.atomic(using=source):
+                    self.lock(source)
+                    copied = self.copy_user(user_id, source, target, clear_target=False)
+                    self.delete_user(user_id, source)
+                self.stdout.write(f"{source} -> {target}: merged {copied} late journeys of user {user_id}")
+
+    def delete_user(self, user_id, db):
+        with transaction.atomic(using=db):
+            for model in (Journey, Car, Settings, FuelType):
+                model.objects.using(db).filter(user_id=user_id).delete()
+
+    def copy_user(self, user_id, source, target, clear_target):
+        """
+        Copy one user's rows from `source` to `target` in a single transaction.
+
+        Ids are reassigned by the target shard, since every shard numbers its
+        rows independently, and foreign keys are remapped to the new ids.
+        """
+        with transaction.atomic(using=target):
+            if clear_target:
+                self.delete_user(user_id, target)
+
+            # When merging, fuel types and settings already on the target win
+            existing_fuels = dict(FuelType.objects.using(target).filter(user_id=user_id).values_list('name', 'pk'))
+            fuel_ids = {}
+            for fuel in FuelType.objects.using(source).filter(user_id=user_id):
+                old_id, fuel.pk = fuel.pk, None
+                if fuel.name not in existing_fuels:
+                    fuel.save(using=target, force_insert=True)
+                fuel_ids[old_id] = existing_fuels.get(fuel.name, fuel.pk)
+
+            car_ids = {}
+            for car in Car.objects.using(source).filter(user_id=user_id):
+                old_id, car.pk = car.pk, None
+                car.fuel_type_id = fuel_ids.get(car.fuel_type_id)
+                car.save(using=target, force_insert=True)
+                car_ids[old_id] = car.pk
+
+            if not Settings.objects.using(target).filter(user_id=user_id).exists():
+                for user_settings in Settings.objects.using(source).filter(user_id=user_id):
+                    user_settings.pk = None
+                    user_settings.default_fuel_type_id = fuel_ids.get(user_settings.default_fuel_type_id)
+                    user_settings.save(using=target, force_insert=True)
+
+            # Keep the original timestamps instead of stamping the copy time
+            created_at = Journey._meta.get_field('created_at')
+            created_at.auto_now_add = False
+            try:
+                copied = self.copy_journeys(user_id, source, target, car_ids, fuel_ids)
+            finally:
+                created_at.auto_now_add = True
+        return copied
+
+    def copy_journeys(self, user_id, source, target, car_ids, fuel_ids):
+        copied = 0
+        batch = []
+        journeys = Journey.objects.using(source).filter(user_id=user_id).order_by('pk')
+        for journey in journeys.iterator(chunk_size=BATCH_SIZE):
+            journey.pk = None
+            journey.car_id = car_ids.get(journey.car_id)
+            journey.fuel_type_ref_id = fuel_ids.get(journey.fuel_type_ref_id)
+            batch.append(journey)
+            if len(batch) >= BATCH_SIZE:
+                Journey.objects.using(target).bulk_create(batch)
+                copied += len(batch)
+                batch = []
+        Journey.objects.using(target).bulk_create(batch)
+        return copied + len(batch)
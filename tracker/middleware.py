@@ -0,0 +1,57 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError
+from django.http import HttpResponse, HttpResponseRedirect
+from django.urls import reverse
+from . import shards
+
+ADMIN_SHARD_PARAM = '_shard'
+ADMIN_SHARD_SESSION_KEY = 'admin_shard'
+
+
+class ShardMiddleware:
+    """
+    Resolves the shard of the logged-in user once per request.
+
+    Staff browsing the admin pick a shard with ?_shard=<n>; the choice is kept
+    in their session since the admin changelist rejects unknown parameters.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.admin_prefix = reverse('admin:index')
+        try:
+            retired = shards.retired_in_use()
+        except DatabaseError:
+            # Not migrated yet, so nobody is assigned anywhere
+            retired = []
+        if retired:
+            raise ImproperlyConfigured(
+                f"Users are still assigned to shard(s) {', '.join(map(str, retired))}, but SHARD_COUNT is "
+                f"{len(shards.aliases())}. Run 'manage.py rebalance_shards --all --from-count {retired[-1] + 1}' first."
+            )
+
+    def __call__(self, request):
+        user = request.user
+        if not user.is_authenticated:
+            return self.get_response(request)
+
+        if user.is_staff and request.path.startswith(self.admin_prefix):
+            if ADMIN_SHARD_PARAM in request.GET:
+                try:
+                    index = int(request.GET[ADMIN_SHARD_PARAM])
+                except ValueError:
+                    index = 0
+                request.session[ADMIN_SHARD_SESSION_KEY] = index if 0 <= index < len(shards.aliases()) else 0
+                params = request.GET.copy()
+                del params[ADMIN_SHARD_PARAM]
+                return HttpResponseRedirect(f"{request.path}?{params.urlencode()}" if params else request.path)
+            with shards.use_db(shards.alias(request.session.get(ADMIN_SHARD_SESSION_KEY, 0))):
+                return self.get_response(request)
+
+        assignment = shards.get_assignment(user.pk)
+        if assignment.moving:
+            response = HttpResponse("Your data is being moved, please retry shortly.", status=503)
+            response['Retry-After'] = '30'
+            return response
+        with shards.use_db(shards.alias(assignment.shard), user.pk):
+            return self.get_response(request)
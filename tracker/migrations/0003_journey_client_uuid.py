@@ -0,0 +1,24 @@
+# Generated by Django 6.0.2 on 2026-10-19 18:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0002_remove_settings_language'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='journey',
+            name='client_uuid',
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='journey',
+            constraint=models.UniqueConstraint(fields=('user', 'client_uuid'), name='unique_journey_client_uuid_per_user'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0.2 on 2026-10-19 18:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0003_journey_client_uuid'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='journey',
+            index=models.Index(fields=['date'], name='journey_date_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 6.0.2 on 2026-10-19 18:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0004_journey_date_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='car',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='cars', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='fueltype',
+            name='user',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='fuel_types', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='journey',
+            name='user',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='journeys', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='settings',
+            name='user',
+            field=models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='settings', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.CreateModel(
+            name='ShardAssignment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField(verbose_name='Shard')),
+                ('moving', models.BooleanField(default=False, verbose_name='Moving')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='shard_assignment', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Shard Assignment',
+                'verbose_name_plural': 'Shard Assignments',
+            },
+        ),
+    ]
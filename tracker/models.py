@@ -3,8 +3,11 @@ from django.utils import timezone
 from django.contrib.auth.models import User
 from django.utils.translation import gettext_lazy as _
 
+# User foreign keys skip the database constraint: with sharding enabled these
+# tables live in shard databases that have no auth_user table.
+
 class FuelType(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='fuel_types', null=True, blank=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='fuel_types', null=True, blank=True, db_constraint=False)
     name = models.CharField(max_length=50, verbose_name=_("Fuel Name"))
     cost_per_unit = models.DecimalField(max_digits=5, decimal_places=2, help_text=_("Current cost per unit (e.g. per liter)"), verbose_name=_("Cost per Unit"))
     unit_name = models.CharField(max_length=20, default='Liters', help_text=_("Unit of measurement (e.g. Liters, Gallons, kWh)"), verbose_name=_("Unit Name"))
@@ -21,7 +24,7 @@ class FuelType(models.Model):
         return self.name
 
 class Car(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='cars')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='cars', db_constraint=False)
     name = models.CharField(max_length=50, verbose_name=_("Car Name"))
     make = models.CharField(max_length=50, blank=True, verbose_name=_("Make"))
     model = models.CharField(max_length=50, blank=True, verbose_name=_("Model"))
@@ -35,7 +38,7 @@ class Car(models.Model):
         return f"{self.name} ({self.make} {self.model})"
 
 class Settings(models.Model):
-    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='settings')
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='settings', db_constraint=False)
     default_fuel_type = models.ForeignKey(FuelType, on_delete=models.SET_NULL, null=True, blank=True, verbose_name=_("Default Fuel Type"))
     currency = models.CharField(max_length=5, default='$', help_text=_("Currency symbol (e.g. $, €, £)"), verbose_name=_("Currency"))
     
@@ -49,7 +52,7 @@ class Settings(models.Model):
         return f"Settings for {self.user.username}"
 
 class Journey(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='journeys', null=True, blank=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='journeys', null=True, blank=True, db_constraint=False)
     car = models.ForeignKey(Car, on_delete=models.SET_NULL, null=True, blank=True, verbose_name=_("Car"))
     date = models.DateField(default=timezone.now, verbose_name=_("Date"))
     distance = models.DecimalField(max_digits=10, decimal_places=2, help_text=_("Distance in kilometers"), verbose_name=_("Distance"))
@@ -63,8 +66,16 @@ class Journey(models.Model):
     fuel_quantity = models.DecimalField(max_digits=10, decimal_places=2, help_text=_("Total units (e.g. liters)"), verbose_name=_("Fuel Quantity"))
     total_cost = models.DecimalField(max_digits=10, decimal_places=2, verbose_name=_("Total Cost"))
     created_at = models.DateTimeField(auto_now_add=True)
+    # Idempotency key generated by the browser for journeys queued while offline
+    client_uuid = models.UUIDField(null=True, blank=True, editable=False)
 
     class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'client_uuid'], name='unique_journey_client_uuid_per_user')
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='journey_date_idx'),
+        ]
         verbose_name = _("Journey")
         verbose_name_plural = _("Journeys")
 
@@ -73,3 +84,17 @@ class Journey(models.Model):
 
     def __str__(self):
         return f"{self.date} - {self.reason} ({self.distance} km)"
+
+class ShardAssignment(models.Model):
+    """Which shard database holds a user's tracker data. Lives on the central database."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='shard_assignment')
+    shard = models.PositiveSmallIntegerField(verbose_name=_("Shard"))
+    # Set while rebalance_shards copies the user's data; requests are refused meanwhile
+    moving = models.BooleanField(default=False, verbose_name=_("Moving"))
+
+    class Meta:
+        verbose_name = _("Shard Assignment")
+        verbose_name_plural = _("Shard Assignments")
+
+    def __str__(self):
+        return f"{self.user.username} -> shard {self.shard}"
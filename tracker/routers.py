@@ -0,0 +1,40 @@
+from django.contrib.auth.models import User
+from . import shards
+
+
+class ShardRouter:
+    """
+    Sends tracker data to the owning user's shard and everything else to 'default'.
+
+    Installed by settings.py only when SHARD_COUNT > 0.
+    """
+
+    def _db_for(self, model, instance=None, **hints):
+        if not shards.is_sharded(model):
+            return 'default'
+        if isinstance(instance, User):
+            return shards.db_for_user(instance.pk)
+        if instance is not None:
+            if getattr(instance, 'user_id', None):
+                return shards.db_for_user(instance.user_id)
+            if instance._state.db:
+                return instance._state.db
+        return shards.current_db()
+
+    db_for_read = _db_for
+    db_for_write = _db_for
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Users live on 'default' while their data lives on a shard
+        if isinstance(obj1, User) or isinstance(obj2, User):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == 'default':
+            # Tracker tables also exist here, empty once data is rebalanced,
+            # so cascades from auth_user and legacy rows keep working
+            return True
+        if app_label != 'tracker':
+            return False
+        return model_name is None or model_name in shards.SHARDED_MODELS
@@ -0,0 +1,162 @@
+"""
+Time series for the reports chart.
+
+Journeys are bucketed by day, week or month in SQL, then each series is
+downsampled with Largest-Triangle-Three-Buckets (LTTB) so a multi-year daily
+series still fits the point budget of a phone-sized chart. Results are cached
+per user in the shared cache configured in settings.CACHES, and invalidated
+whenever one of their journeys, cars or fuel types changes.
+"""
+import datetime
+import uuid
+from django.core.cache import cache
+from django.db.models import Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+from .models import Journey
+
+GRANULARITIES = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+METRICS = ('distance', 'cost', 'cost_per_km')
+GROUPS = {
+    'none': None,
+    'car': 'car__name',
+    # Grouped by the stored name, like reports_view, so deleted fuel types keep their history
+    'fuel_type': 'fuel_type',
+}
+DEFAULT_POINTS = 500
+MIN_POINTS = 3
+MAX_POINTS = 5000
+# Journey saves bump the per-user version, so this only bounds staleness
+# after bulk updates that bypass model signals (e.g. QuerySet.update)
+CACHE_TIMEOUT = 60 * 60
+
+
+def lttb(points, threshold):
+    """
+    Downsample [(x, y), ...] to at most `threshold` points with LTTB.
+
+    x must be numeric and increasing. The first and last points are always kept.
+    """
+    n = len(points)
+    if threshold >= n or threshold < MIN_POINTS:
+        return list(points)
+
+    sampled = [points[0]]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third corner of the triangle
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        next_bucket = points[next_start:next_end]
+        avg_x = sum(p[0] for p in next_bucket) / len(next_bucket)
+        avg_y = sum(p[1] for p in next_bucket) / len(next_bucket)
+
+        ax, ay = points[a]
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        best_area = -1.0
+        best = start
+        for j in range(start, end):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+        sampled.append(points[best])
+        a = best
+    sampled.append(points[-1])
+    return sampled
+
+
+def _version_key(user_id):
+    return f'series-version:{user_id}'
+
+
+def _version(user_id):
+    # Random rather than a counter: if the cache culls this key, a new
+    # version can never collide with entries cached under an older one
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(key, version, None)
+    return version
+
+
+def invalidate(user_id):
+    """Invalidate every cached series of a user."""
+    cache.set(_version_key(user_id), uuid.uuid4().hex, None)
+
+
+def _bucket_rows(user, granularity, group_field, start, end):
+    journeys = Journey.objects.filter(user=user)
+    if start:
+        journeys = journeys.filter(date__gte=start)
+    if end:
+        journeys = journeys.filter(date__lte=end)
+
+    fields = ['bucket'] if group_field is None else [group_field, 'bucket']
+    return (
+        journeys
+        .annotate(bucket=GRANULARITIES[granularity]('date'))
+        .values(*fields)
+        .annotate(distance=Sum('distance'), cost=Sum('total_cost'))
+        .order_by(*fields)
+    )
+
+
+def _value(row, metric):
+    if metric == 'distance':
+        return float(row['distance'] or 0)
+    if metric == 'cost':
+        return float(row['cost'] or 0)
+    # Ratio of sums, so long trips weigh more than short ones
+    if not row['distance']:
+        return None
+    return float(row['cost'] or 0) / float(row['distance'])
+
+
+def build_series(user, granularity='month', metric='distance', group='none', points=DEFAULT_POINTS, start=None, end=None):
+    """
+    Return the chart payload for a user, serving it from the cache when possible.
+
+    Arguments are expected to be validated already (see GRANULARITIES,
+    METRICS, GROUPS and MIN_POINTS..MAX_POINTS).
+    """
+    version = _version(user.pk)
+    key = f'series:{user.pk}:{version}:{granularity}:{metric}:{group}:{points}:{start}:{end}'
+    payload = cache.get(key)
+    if payload is not None:
+        return payload
+
+    group_field = GROUPS[group]
+    grouped = {}
+    for row in _bucket_rows(user, granularity, group_field, start, end):
+        value = _value(row, metric)
+        if value is None:
+            continue
+        name = 'All' if group_field is None else (row[group_field] or 'Unassigned')
+        grouped.setdefault(name, []).append((row['bucket'].toordinal(), value))
+
+    precision = 4 if metric == 'cost_per_km' else 2
+    series = []
+    for name, raw in grouped.items():
+        sampled = lttb(raw, points)
+        series.append({
+            'name': name,
+            'total_points': len(raw),
+            'points': [[datetime.date.fromordinal(x).isoformat(), round(y, precision)] for x, y in sampled],
+        })
+
+    payload = {
+        'granularity': granularity,
+        'metric': metric,
+        'group': group,
+        'series': series,
+    }
+    cache.set(key, payload, CACHE_TIMEOUT)
+    return payload
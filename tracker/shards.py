@@ -0,0 +1,104 @@
+"""
+Per-user sharding of tracker data across SQLite files.
+
+With SHARD_COUNT > 0, every user's journeys, cars, fuel types and settings
+live in one shard database ('shard_0' .. 'shard_<N-1>'), so writes from
+different users no longer queue on a single SQLite lock. Auth, sessions and
+the ShardAssignment directory stay on 'default'.
+
+A user is placed by a stable hash of their id the first time they are seen,
+and that placement is pinned in ShardAssignment so raising SHARD_COUNT never
+moves existing data. Lowering it leaves users on shards that are no longer
+configured: the app refuses to start until `rebalance_shards --all
+--from-count <old count>` has moved them.
+"""
+import hashlib
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections
+
+# Models routed to shards; everything else stays on 'default'
+SHARDED_MODELS = ('fueltype', 'car', 'settings', 'journey')
+
+# (user_id, alias) resolved for the current request or command
+_current = ContextVar('tracker_shard', default=None)
+
+
+def enabled():
+    return getattr(settings, 'SHARD_COUNT', 0) > 0
+
+
+def alias(index):
+    return f'shard_{index}'
+
+
+def aliases():
+    return [alias(index) for index in range(settings.SHARD_COUNT)]
+
+
+def configure_retired(count):
+    """
+    Define shard aliases from SHARD_COUNT up to `count`, i.e. the shards left
+    behind by lowering SHARD_COUNT, so their data can be read and moved.
+    Aliases that are already configured are left as they are.
+    """
+    template = connections.databases[alias(0)]
+    for index in range(settings.SHARD_COUNT, count):
+        connections.databases.setdefault(alias(index), {**template, 'NAME': settings.DATA_DIR / f'shard_{index}.sqlite3'})
+
+
+def retired_in_use():
+    """Shard indexes at or above SHARD_COUNT that users are still assigned to."""
+    from .models import ShardAssignment
+    return list(
+        ShardAssignment.objects.using('default').filter(shard__gte=settings.SHARD_COUNT)
+        .order_by('shard').values_list('shard', flat=True).distinct()
+    )
+
+
+def is_sharded(model):
+    return model._meta.app_label == 'tracker' and model._meta.model_name in SHARDED_MODELS
+
+
+def hashed_shard(user_id):
+    """Stable across processes and restarts, unlike hash()."""
+    digest = hashlib.blake2b(str(user_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % settings.SHARD_COUNT
+
+
+def get_assignment(user_id):
+    from .models import ShardAssignment
+    assignment, created = ShardAssignment.objects.using('default').get_or_create(
+        user_id=user_id, defaults={'shard': hashed_shard(user_id)}
+    )
+    return assignment
+
+
+def db_for_user(user_id):
+    current = _current.get()
+    if current is not None and current[0] == user_id:
+        return current[1]
+    return alias(get_assignment(user_id).shard)
+
+
+def current_db():
+    current = _current.get()
+    return current[1] if current is not None else None
+
+
+@contextmanager
+def use_db(db, user_id=None):
+    """Route unhinted tracker queries to `db` for the duration of the block."""
+    token = _current.set((user_id, db))
+    try:
+        yield db
+    finally:
+        _current.reset(token)
+
+
+def use_shard(user):
+    """Route tracker queries to `user`'s shard, e.g. in management commands."""
+    if not enabled():
+        return nullcontext()
+    return use_db(db_for_user(user.pk), user.pk)
@@ -0,0 +1,43 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from .models import Journey, Car, Settings, FuelType
+from . import series, shards
+
+_muted = ContextVar('tracker_series_invalidation_muted', default=False)
+
+
+@contextmanager
+def bulk_changes(user_id):
+    """Invalidate a user's series once for a block of changes, not per row."""
+    token = _muted.set(True)
+    try:
+        yield
+    finally:
+        _muted.reset(token)
+        series.invalidate(user_id)
+
+
+# Cars are shown by name in grouped series, and deleting one moves its
+# journeys to 'Unassigned' with an UPDATE that sends no Journey signals
+@receiver(post_save, sender=Journey)
+@receiver(post_delete, sender=Journey)
+@receiver(post_save, sender=Car)
+@receiver(post_delete, sender=Car)
+@receiver(post_save, sender=FuelType)
+@receiver(post_delete, sender=FuelType)
+def invalidate_series(sender, instance, **kwargs):
+    if instance.user_id and not _muted.get():
+        series.invalidate(instance.user_id)
+
+
+@receiver(pre_delete, sender=User)
+def delete_shard_data(sender, instance, **kwargs):
+    # The cascade from auth_user only reaches the central database
+    if shards.enabled():
+        db = shards.db_for_user(instance.pk)
+        with bulk_changes(instance.pk):
+            for model in (Journey, Car, Settings, FuelType):
+                model.objects.using(db).filter(user_id=instance.pk).delete()
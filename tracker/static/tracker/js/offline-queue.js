@@ -0,0 +1,131 @@
+// IndexedDB-backed queue of journeys logged while offline.
+// Loaded both by pages (window) and by the service worker (importScripts),
+// so it only relies on APIs available in both contexts.
+(function (scope) {
+    const DB_NAME = 'mileage-tracker';
+    const STORE = 'pending-journeys';
+    const SYNC_TAG = 'sync-journeys';
+    const BATCH_SIZE = 100;
+
+    function openDb() {
+        return new Promise(function (resolve, reject) {
+            const request = indexedDB.open(DB_NAME, 1);
+            request.onupgradeneeded = function () {
+                request.result.createObjectStore(STORE, { keyPath: 'client_uuid' });
+            };
+            request.onsuccess = function () { resolve(request.result); };
+            request.onerror = function () { reject(request.error); };
+        });
+    }
+
+    function withStore(mode, callback) {
+        return openDb().then(function (db) {
+            return new Promise(function (resolve, reject) {
+                const tx = db.transaction(STORE, mode);
+                const result = callback(tx.objectStore(STORE));
+                tx.oncomplete = function () { db.close(); resolve(result && result.result); };
+                tx.onerror = function () { db.close(); reject(tx.error); };
+            });
+        });
+    }
+
+    function enqueue(entry, csrfToken) {
+        entry.client_uuid = entry.client_uuid || crypto.randomUUID();
+        entry.csrf_token = csrfToken;
+        entry.queued_at = new Date().toISOString();
+        return withStore('readwrite', function (store) { return store.put(entry); });
+    }
+
+    function all() {
+        return withStore('readonly', function (store) { return store.getAll(); });
+    }
+
+    function get(key) {
+        return withStore('readonly', function (store) { return store.get(key); });
+    }
+
+    // Only entries that will still be sent; rejected ones wait for the driver
+    function count() {
+        return all().then(function (entries) {
+            return entries.filter(function (entry) { return !entry.errors; }).length;
+        });
+    }
+
+    function rejected() {
+        return all().then(function (entries) {
+            return entries.filter(function (entry) { return entry.errors; });
+        });
+    }
+
+    function remove(keys) {
+        return withStore('readwrite', function (store) {
+            keys.forEach(function (key) { store.delete(key); });
+        });
+    }
+
+    function markRejected(results) {
+        return withStore('readwrite', function (store) {
+            results.forEach(function (result) {
+                const request = store.get(result.client_uuid);
+                request.onsuccess = function () {
+                    if (request.result) {
+                        request.result.errors = result.errors;
+                        store.put(request.result);
+                    }
+                };
+            });
+        });
+    }
+
+    // Replays queued journeys against the batch endpoint. Entries the server
+    // created or already had are dropped; rejected ones stay queued with their
+    // errors until the driver edits or discards them, so nothing they typed is
+    // silently lost. Pages pass the current CSRF cookie, since the token
+    // captured at queue time may have been rotated by a login in the meantime.
+    function flush(syncUrl, csrfToken) {
+        return all().then(function (entries) {
+            const pending = entries.filter(function (entry) { return !entry.errors; });
+            if (!pending.length) {
+                return 0;
+            }
+            const batch = pending.slice(0, BATCH_SIZE);
+            return fetch(syncUrl, {
+                method: 'POST',
+                credentials: 'same-origin',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'X-CSRFToken': csrfToken || batch[batch.length - 1].csrf_token,
+                },
+                body: JSON.stringify({ journeys: batch }),
+            }).then(function (response) {
+                const type = response.headers.get('Content-Type') || '';
+                if (!response.ok || type.indexOf('application/json') === -1) {
+                    throw new Error('Journey sync failed with status ' + response.status);
+                }
+                return response.json();
+            }).then(function (data) {
+                const done = data.results
+                    .filter(function (r) { return r.status === 'created' || r.status === 'duplicate'; })
+                    .map(function (r) { return r.client_uuid; });
+                const rejected = data.results.filter(function (r) { return r.status === 'invalid' && r.client_uuid; });
+                return remove(done)
+                    .then(function () { return markRejected(rejected); })
+                    .then(function () {
+                        // Keep going while full batches are being accepted
+                        return pending.length > BATCH_SIZE && done.length ? flush(syncUrl, csrfToken) : done.length;
+                    });
+            });
+        });
+    }
+
+    scope.JourneyQueue = {
+        SYNC_TAG: SYNC_TAG,
+        enqueue: enqueue,
+        all: all,
+        get: get,
+        count: count,
+        rejected: rejected,
+        discard: function (key) { return remove([key]); },
+        flush: flush,
+    };
+})(self);
@@ -0,0 +1,122 @@
+// Registers the service worker and keeps the offline journey queue moving.
+// URLs and labels are passed as data attributes on the <script> tag in base.html.
+(function () {
+    const config = document.currentScript.dataset;
+
+    function csrfCookie() {
+        const match = document.cookie.match(/(?:^|;\s*)csrftoken=([^;]+)/);
+        return match ? decodeURIComponent(match[1]) : null;
+    }
+
+    // Every journey form gets an idempotency key, so a submit that is retried
+    // (by the driver or by the offline queue) is only ever stored once.
+    document.querySelectorAll('input[name="client_uuid"]').forEach(function (input) {
+        if (!input.value && window.crypto && crypto.randomUUID) {
+            input.value = crypto.randomUUID();
+        }
+    });
+
+    function showPending() {
+        const banner = document.getElementById('sync-status');
+        if (!banner || !window.indexedDB) {
+            return;
+        }
+        JourneyQueue.count().then(function (count) {
+            banner.hidden = !count;
+            banner.querySelector('[data-count]').textContent = count;
+        }).catch(function () {});
+    }
+
+    function errorText(errors) {
+        return Object.keys(errors).map(function (field) {
+            const messages = errors[field].map(function (error) { return error.message || error; }).join(' ');
+            return field === '__all__' ? messages : field + ': ' + messages;
+        }).join(' ');
+    }
+
+    // Journeys the server refused are listed until the driver edits or discards them
+    function showRejected() {
+        const panel = document.getElementById('sync-rejected');
+        const template = document.getElementById('sync-rejected-item');
+        if (!panel || !template || !window.indexedDB) {
+            return;
+        }
+        JourneyQueue.rejected().then(function (entries) {
+            const list = panel.querySelector('[data-list]');
+            list.replaceChildren();
+            entries.forEach(function (entry) {
+                const item = template.content.firstElementChild.cloneNode(true);
+                item.querySelector('[data-summary]').textContent =
+                    [entry.date, entry.distance, entry.reason].filter(Boolean).join(' · ');
+                item.querySelector('[data-errors]').textContent = errorText(entry.errors);
+                item.querySelector('[data-edit]').href =
+                    config.addJourneyUrl + '?retry=' + encodeURIComponent(entry.client_uuid);
+                item.querySelector('[data-discard]').addEventListener('click', function () {
+                    JourneyQueue.discard(entry.client_uuid).then(showRejected);
+                });
+                list.appendChild(item);
+            });
+            panel.hidden = !entries.length;
+        }).catch(function () {});
+    }
+
+    // Opening the add form with ?retry=<client_uuid> loads a rejected entry
+    // into it. Submitting replaces the entry: the journey is either stored or
+    // queued again under the same key.
+    function loadRetry() {
+        const retry = new URLSearchParams(window.location.search).get('retry');
+        const input = document.querySelector('input[name="client_uuid"]');
+        if (!retry || !input || !window.indexedDB) {
+            return;
+        }
+        JourneyQueue.get(retry).then(function (entry) {
+            if (!entry) {
+                return;
+            }
+            const form = input.form;
+            Object.keys(entry).forEach(function (name) {
+                const field = form.elements[name];
+                if (field && name !== 'csrfmiddlewaretoken' && typeof entry[name] === 'string') {
+                    field.value = entry[name];
+                }
+            });
+            form.addEventListener('submit', function () { JourneyQueue.discard(entry.client_uuid); });
+        }).catch(function () {});
+    }
+
+    function flush() {
+        if (!navigator.onLine || !window.indexedDB) {
+            return;
+        }
+        JourneyQueue.flush(config.syncUrl, csrfCookie())
+            .then(function (synced) {
+                showPending();
+                showRejected();
+                // Totals on the page predate the synced journeys, but a form
+                // the driver may be filling in is never thrown away
+                if (synced && window.caches) {
+                    caches.open('mileage-pages')
+                        .then(function (cache) { return cache.delete(config.dashboardUrl); })
+                        .then(function () {
+                            if (!document.querySelector('form[method="post"]')) {
+                                window.location.reload();
+                            }
+                        });
+                }
+            })
+            .catch(function () {
+                showPending();
+                showRejected();
+            });
+    }
+
+    if ('serviceWorker' in navigator) {
+        navigator.serviceWorker.register(config.swUrl).catch(function () {});
+    }
+
+    window.addEventListener('online', flush);
+    loadRetry();
+    showPending();
+    showRejected();
+    flush();
+})();
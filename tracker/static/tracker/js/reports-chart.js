@@ -0,0 +1,90 @@
+// Minimal SVG line chart for the reports page, fed by the series API.
+// The point budget requested from the server follows the chart's rendered
+// width, so a phone never downloads more points than it has pixels.
+(function () {
+    const root = document.getElementById('series-chart');
+    if (!root) {
+        return;
+    }
+    const svg = root.querySelector('svg');
+    const legend = root.querySelector('[data-legend]');
+    const empty = root.querySelector('[data-empty]');
+    const controls = root.querySelectorAll('select');
+    const currency = root.dataset.currency;
+    const COLORS = ['#FAC638', '#92c9ad', '#60a5fa', '#f472b6', '#a78bfa', '#fb923c'];
+    const HEIGHT = 180;
+    const PAD = { top: 10, right: 8, bottom: 20, left: 44 };
+    const SVG_NS = 'http://www.w3.org/2000/svg';
+
+    function el(name, attrs, text) {
+        const node = document.createElementNS(SVG_NS, name);
+        Object.keys(attrs).forEach(function (key) { node.setAttribute(key, attrs[key]); });
+        if (text !== undefined) {
+            node.textContent = text;
+        }
+        return node;
+    }
+
+    function format(value, metric) {
+        if (metric === 'distance') {
+            return value.toFixed(0) + ' km';
+        }
+        return currency + value.toFixed(metric === 'cost_per_km' ? 2 : 0);
+    }
+
+    function draw(data, width) {
+        svg.replaceChildren();
+        legend.replaceChildren();
+        svg.setAttribute('viewBox', '0 0 ' + width + ' ' + HEIGHT);
+
+        const all = [];
+        data.series.forEach(function (s) { s.points.forEach(function (p) { all.push(p); }); });
+        empty.hidden = all.length > 0;
+        if (!all.length) {
+            return;
+        }
+
+        const times = all.map(function (p) { return Date.parse(p[0]); });
+        const minX = Math.min.apply(null, times);
+        const maxX = Math.max.apply(null, times);
+        const maxY = Math.max.apply(null, all.map(function (p) { return p[1]; })) || 1;
+        const plotW = width - PAD.left - PAD.right;
+        const plotH = HEIGHT - PAD.top - PAD.bottom;
+        const x = function (t) { return PAD.left + (maxX === minX ? plotW / 2 : (t - minX) / (maxX - minX) * plotW); };
+        const y = function (v) { return PAD.top + plotH - v / maxY * plotH; };
+
+        [0, 0.5, 1].forEach(function (f) {
+            svg.appendChild(el('line', { x1: PAD.left, x2: width - PAD.right, y1: y(maxY * f), y2: y(maxY * f), stroke: 'currentColor', 'stroke-opacity': 0.1 }));
+            svg.appendChild(el('text', { x: PAD.left - 4, y: y(maxY * f) + 3, 'text-anchor': 'end', 'font-size': 9, fill: 'currentColor', 'fill-opacity': 0.6 }, format(maxY * f, data.metric)));
+        });
+        [minX, maxX].forEach(function (t, i) {
+            svg.appendChild(el('text', { x: x(t), y: HEIGHT - 4, 'text-anchor': i ? 'end' : 'start', 'font-size': 9, fill: 'currentColor', 'fill-opacity': 0.6 }, new Date(t).toISOString().slice(0, 10)));
+        });
+
+        data.series.forEach(function (s, i) {
+            const color = COLORS[i % COLORS.length];
+            const path = s.points.map(function (p) { return x(Date.parse(p[0])).toFixed(1) + ',' + y(p[1]).toFixed(1); }).join(' ');
+            svg.appendChild(el('polyline', { points: path, fill: 'none', stroke: color, 'stroke-width': 2, 'stroke-linejoin': 'round' }));
+
+            const item = document.createElement('span');
+            item.className = 'flex items-center gap-1';
+            item.innerHTML = '<span class="inline-block size-2 rounded-full"></span>';
+            item.firstChild.style.background = color;
+            item.appendChild(document.createTextNode(s.name + (s.total_points > s.points.length ? ' (' + s.points.length + '/' + s.total_points + ')' : '')));
+            legend.appendChild(item);
+        });
+    }
+
+    function load() {
+        const width = Math.max(240, Math.round(svg.getBoundingClientRect().width));
+        const params = new URLSearchParams({ points: width });
+        controls.forEach(function (select) { params.set(select.name, select.value); });
+        fetch(root.dataset.url + '?' + params, { credentials: 'same-origin' })
+            .then(function (response) { return response.ok ? response.json() : Promise.reject(response.status); })
+            .then(function (data) { draw(data, width); })
+            .catch(function () { empty.hidden = false; });
+    }
+
+    controls.forEach(function (select) { select.addEventListener('change', load); });
+    load();
+})();
@@ -1,3 +1,617 @@
-from django.test import TestCase
+import datetime
+import json
+import random
+import uuid
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from . import shards
+from .admin import EstimatedCountPaginator
+from .management.commands.rebalance_shards import Command
+from .middleware import ADMIN_SHARD_SESSION_KEY, ShardMiddleware
+from .models import Journey, FuelType, Car, Settings, ShardAssignment
+from .series import MAX_POINTS, MIN_POINTS, build_series, lttb
+from .tracks import BATCH_SIZE, TrackSummary, np, parse_track
+from .views import SYNC_BATCH_LIMIT
 
-# Create your tests here.
+# Templates use {% static %}, which the manifest storage rejects without collectstatic
+TEST_STORAGES = {
+    **settings.STORAGES,
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(STORAGES=TEST_STORAGES, CACHES=TEST_CACHES)
+class OfflineSyncTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('driver', password='pw')
+        self.fuel = FuelType.objects.create(user=self.user, name='Petrol', cost_per_unit=2, efficiency=10)
+        self.client.force_login(self.user)
+
+    def journey_data(self, **overrides):
+        data = {
+            'client_uuid': str(uuid.uuid4()),
+            'fuel_type_select': str(self.fuel.pk),
+            'date': '2024-05-01',
+            'distance': '50',
+            'reason': 'Client visit',
+        }
+        data.update(overrides)
+        return data
+
+    def sync(self, entries):
+        return self.client.post(reverse('sync_journeys'), json.dumps({'journeys': entries}), content_type='application/json')
+
+    def test_add_journey_with_repeated_client_uuid_is_stored_once(self):
+        data = self.journey_data()
+        for _ in range(2):
+            response = self.client.post(reverse('add_journey'), data)
+            self.assertRedirects(response, reverse('dashboard'))
+        journey = Journey.objects.get(user=self.user)
+        self.assertEqual(str(journey.client_uuid), data['client_uuid'])
+        self.assertEqual(journey.fuel_quantity, 5)
+        self.assertEqual(journey.total_cost, 10)
+
+    def test_same_client_uuid_is_separate_per_user(self):
+        data = self.journey_data()
+        self.client.post(reverse('add_journey'), data)
+        other = User.objects.create_user('other')
+        fuel = FuelType.objects.create(user=other, name='Diesel', cost_per_unit=2, efficiency=10)
+        self.client.force_login(other)
+        self.client.post(reverse('add_journey'), {**data, 'fuel_type_select': str(fuel.pk)})
+        self.assertEqual(Journey.objects.filter(client_uuid=data['client_uuid']).count(), 2)
+
+    def test_sync_reports_created_duplicate_and_invalid_entries(self):
+        valid = self.journey_data()
+        invalid = self.journey_data(distance='')
+        response = self.sync([valid, valid, invalid, {'date': '2024-05-01'}])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], ['created', 'duplicate', 'invalid', 'invalid'])
+        self.assertEqual(results[0]['id'], results[1]['id'])
+        self.assertIn('distance', results[2]['errors'])
+        self.assertEqual(results[2]['client_uuid'], invalid['client_uuid'])
+        self.assertIsNone(results[3]['client_uuid'])
+        self.assertEqual(Journey.objects.filter(user=self.user).count(), 1)
+
+    def test_sync_replay_of_a_form_submit_is_duplicate(self):
+        data = self.journey_data()
+        self.client.post(reverse('add_journey'), data)
+        results = self.sync([data]).json()['results']
+        self.assertEqual(results[0]['status'], 'duplicate')
+        self.assertEqual(Journey.objects.filter(user=self.user).count(), 1)
+
+    def test_sync_rejects_batches_over_the_limit(self):
+        response = self.sync([self.journey_data() for _ in range(SYNC_BATCH_LIMIT + 1)])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Journey.objects.exists())
+
+    def test_failed_save_is_not_reported_as_duplicate(self):
+        # Zero efficiency leaves fuel_quantity empty, which the column refuses
+        broken = FuelType.objects.create(user=self.user, name='Broken', cost_per_unit=2, efficiency=0)
+        entry = self.journey_data(fuel_type_select=str(broken.pk))
+        results = self.sync([entry]).json()['results']
+        self.assertEqual(results[0]['status'], 'invalid')
+        self.assertEqual(results[0]['client_uuid'], entry['client_uuid'])
+        self.assertIn('__all__', results[0]['errors'])
+        for data in (entry, {**entry, 'client_uuid': ''}):
+            with self.assertRaises(IntegrityError):
+                self.client.post(reverse('add_journey'), data)
+        self.assertFalse(Journey.objects.exists())
+
+    def test_sync_rejects_malformed_payloads(self):
+        for body in ('not json', json.dumps({}), json.dumps({'journeys': {}})):
+            response = self.client.post(reverse('sync_journeys'), body, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+    def test_sync_requires_login(self):
+        self.client.logout()
+        response = self.sync([self.journey_data()])
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(Journey.objects.exists())
+
+
+def gpx(points, namespace=True, time=None):
+    ns = ' xmlns="http://www.topografix.com/GPX/1/1"' if namespace else ''
+    first = f'<time>{time}</time>' if time else ''
+    body = ''.join(f'<trkpt lat="{lat}" lon="{lon}">{first if i == 0 else ""}</trkpt>' for i, (lat, lon) in enumerate(points))
+    return f'<?xml version="1.0"?><gpx version="1.1"{ns}><trk><trkseg>{body}</trkseg></trk></gpx>'.encode()
+
+
+# 0.001 degrees of longitude on the equator, in kilometres
+EQUATOR_STEP_KM = 0.11119508
+
+
+class TrackParsingTests(SimpleTestCase):
+    line = [(0, i / 1000) for i in range(11)]
+
+    def parse(self, content, name='track.gpx', **kwargs):
+        return parse_track(ContentFile(content, name=name), **kwargs)
+
+    def test_gpx_with_namespace(self):
+        summary = self.parse(gpx(self.line, time='2024-05-01T08:30:00+00:00'))
+        self.assertEqual(summary.points, 11)
+        self.assertAlmostEqual(summary.distance, 10 * EQUATOR_STEP_KM, places=4)
+        self.assertEqual(summary.started_at, datetime.datetime(2024, 5, 1, 8, 30, tzinfo=datetime.timezone.utc))
+
+    def test_gpx_with_prefixed_namespace(self):
+        content = gpx(self.line).replace(b'xmlns=', b'xmlns:g=').replace(b'<trkpt', b'<g:trkpt').replace(b'</trkpt', b'</g:trkpt')
+        self.assertAlmostEqual(self.parse(content).distance, 10 * EQUATOR_STEP_KM, places=4)
+
+    def test_gpx_without_namespace_is_sniffed(self):
+        summary = self.parse(gpx(self.line, namespace=False), name='upload')
+        self.assertEqual(summary.points, 11)
+        self.assertIsNone(summary.started_at)
+
+    def test_csv_column_aliases(self):
+        rows = '\n'.join(f'{lat},{lon},2024-05-01T08:{i:02d}:00' for i, (lat, lon) in enumerate(self.line))
+        for header in ('lat,lon,time', 'Latitude,Longitude,Timestamp', 'latitude, lng ,datetime'):
+            with self.subTest(header=header):
+                summary = self.parse(f'{header}\n{rows}\n'.encode(), name='track.csv')
+                self.assertEqual(summary.points, 11)
+                self.assertAlmostEqual(summary.distance, 10 * EQUATOR_STEP_KM, places=4)
+                self.assertEqual(summary.started_at, datetime.datetime(2024, 5, 1, 8, 0))
+
+    def test_malformed_tracks_raise_value_error(self):
+        cases = {
+            'track.csv': [
+                b'x,y\n1,2\n3,4\n',
+                b'lat,lon\n0,0\nabc,0.01\n',
+                b'lat,lon\n0,0\n0.01\n',
+                b'lat,lon\n0,0\n91,0\n',
+                b'lat,lon\n0,0\n',
+            ],
+            'track.gpx': [
+                b'<gpx><trkpt lat="0" lon="0"></gpx>',
+                b'<gpx><trkpt lat="0"/><trkpt lat="0" lon="1"/></gpx>',
+                b'<gpx><trkpt lat="0" lon="x"/><trkpt lat="0" lon="1"/></gpx>',
+            ],
+        }
+        for name, contents in cases.items():
+            for content in contents:
+                with self.subTest(content=content), self.assertRaises(ValueError):
+                    self.parse(content, name=name)
+
+    def test_track_without_distance_is_rejected(self):
+        with self.assertRaisesMessage(ValueError, 'no distance'):
+            self.parse(gpx([(0, 0), (0, 0.000009)]))
+
+    def test_jitter_is_dropped(self):
+        # Sub-metre wobble between every real point
+        jittery = []
+        for lat, lon in self.line:
+            jittery += [(lat, lon), (lat + 0.000005, lon + 0.0000005)]
+        summary = self.parse(gpx(jittery))
+        self.assertEqual((summary.points, summary.kept_points), (22, 11))
+        self.assertAlmostEqual(summary.distance, 10 * EQUATOR_STEP_KM, places=4)
+        unfiltered = self.parse(gpx(jittery), min_step=0)
+        self.assertEqual(unfiltered.kept_points, 22)
+        self.assertGreater(unfiltered.distance, summary.distance)
+
+    @skipUnless(np is not None, "NumPy is not installed")
+    def test_numpy_and_python_agree(self):
+        rng = random.Random(1)
+        points = [(45 + rng.uniform(-0.5, 0.5), 7 + rng.uniform(-0.5, 0.5)) for _ in range(2 * BATCH_SIZE + 100)]
+        summaries = [TrackSummary(vectorized=vectorized) for vectorized in (True, False)]
+        for summary in summaries:
+            for lat, lon in points:
+                summary.add(lat, lon)
+        self.assertEqual(summaries[0].kept_points, summaries[1].kept_points)
+        self.assertAlmostEqual(summaries[0].distance, summaries[1].distance, delta=summaries[1].distance * 1e-9)
+
+    def test_batches_join_up(self):
+        summary = TrackSummary(vectorized=False)
+        for i in range(BATCH_SIZE * 2 + 1):
+            summary.add(0, i / 1000)
+        self.assertAlmostEqual(summary.distance, BATCH_SIZE * 2 * EQUATOR_STEP_KM, places=2)
+
+
+@override_settings(STORAGES=TEST_STORAGES, CACHES=TEST_CACHES)
+class TrackImportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('driver')
+        self.fuel = FuelType.objects.create(user=self.user, name='Petrol', cost_per_unit=2, efficiency=10)
+        self.client.force_login(self.user)
+
+    def post(self, content):
+        return self.client.post(reverse('import_track'), {
+            'fuel_type_select': self.fuel.pk,
+            'reason': 'Commute',
+            'track': ContentFile(content, name='track.gpx'),
+        })
+
+    def test_import_creates_journey_with_costs(self):
+        response = self.post(gpx(TrackParsingTests.line, time='2024-05-01T08:30:00+00:00'))
+        self.assertRedirects(response, reverse('dashboard'))
+        journey = Journey.objects.get(user=self.user)
+        self.assertEqual(journey.distance, Decimal('1.11'))
+        self.assertEqual(journey.date, datetime.date(2024, 5, 1))
+        self.assertEqual((journey.fuel_quantity, journey.cost_per_liter, journey.total_cost), (Decimal('0.11'), 2, Decimal('0.22')))
+
+    def test_short_track_still_gets_costs(self):
+        # 20 m at 10 km per unit rounds to a quantity of 0
+        self.post(gpx([(0, 0), (0, 0.00018)]))
+        journey = Journey.objects.get(user=self.user)
+        self.assertEqual((journey.fuel_quantity, journey.cost_per_liter, journey.total_cost), (0, 2, 0))
+
+    def test_zero_distance_track_is_a_form_error(self):
+        response = self.post(gpx([(0, 0), (0, 0.000009)]))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('track', response.context['form'].errors)
+        self.assertFalse(Journey.objects.exists())
+
+
+class LttbTests(SimpleTestCase):
+    points = [(x, (x * 37 % 11) - 5.0) for x in range(1000)]
+
+    def test_keeps_endpoints_and_respects_threshold(self):
+        for threshold in (MIN_POINTS, 10, 99, 500, 999):
+            with self.subTest(threshold=threshold):
+                sampled = lttb(self.points, threshold)
+                self.assertEqual(len(sampled), threshold)
+                self.assertEqual((sampled[0], sampled[-1]), (self.points[0], self.points[-1]))
+                self.assertEqual(sampled, sorted(sampled))
+                self.assertTrue(set(sampled) <= set(self.points))
+
+    def test_short_series_pass_through(self):
+        for threshold in (1000, 5000):
+            self.assertEqual(lttb(self.points, threshold), self.points)
+        self.assertEqual(lttb(self.points[:2], MIN_POINTS), self.points[:2])
+        self.assertEqual(lttb([], 10), [])
+
+    def test_keeps_spikes(self):
+        points = [(x, 0.0) for x in range(100)]
+        points[40] = (40, 100.0)
+        self.assertIn((40, 100.0), lttb(points, 10))
+
+
+@override_settings(STORAGES=TEST_STORAGES, CACHES=TEST_CACHES)
+class SeriesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('driver')
+        self.car = Car.objects.create(user=self.user, name='Panda')
+        for day in range(1, 31):
+            Journey.objects.create(
+                user=self.user, car=self.car, date=datetime.date(2024, 4, day), distance=10, reason='Commute',
+                fuel_type='Petrol', cost_per_liter=2, fuel_quantity=1, total_cost=2,
+            )
+        self.client.force_login(self.user)
+
+    def get(self, **params):
+        return self.client.get(reverse('series_api'), params)
+
+    def test_invalid_parameters(self):
+        for params in ({'granularity': 'hour'}, {'metric': 'speed'}, {'group': 'reason'},
+                       {'points': 'many'}, {'start': '2024-13-01'}, {'end': 'yesterday'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.get(**params).status_code, 400)
+
+    def test_points_are_clamped(self):
+        data = self.get(granularity='day', points=1).json()
+        self.assertEqual(len(data['series'][0]['points']), MIN_POINTS)
+        data = self.get(granularity='day', points=MAX_POINTS * 10).json()
+        self.assertEqual(data['series'][0]['total_points'], 30)
+        self.assertEqual(len(data['series'][0]['points']), 30)
+
+    def test_date_range_and_grouping(self):
+        data = self.get(granularity='day', group='car', metric='cost_per_km', start='2024-04-11', end='2024-04-20').json()
+        self.assertEqual([serie['name'] for serie in data['series']], ['Panda'])
+        points = data['series'][0]['points']
+        self.assertEqual((points[0][0], points[-1][0], len(points)), ('2024-04-11', '2024-04-20', 10))
+        self.assertEqual(points[0][1], 0.2)
+
+    def test_requires_login(self):
+        self.client.logout()
+        self.assertEqual(self.get().status_code, 401)
+
+    def test_cached_until_a_journey_changes(self):
+        first = build_series(self.user, group='car')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(build_series(self.user, group='car'), first)
+        self.assertEqual(len(queries), 0)
+
+        Journey.objects.filter(user=self.user).first().delete()
+        self.assertEqual(build_series(self.user, group='car')['series'][0]['points'][0][1], 290.0)
+
+    def test_car_rename_invalidates(self):
+        build_series(self.user, group='car')
+        self.car.name = 'Fiat'
+        self.car.save()
+        self.assertEqual(build_series(self.user, group='car')['series'][0]['name'], 'Fiat')
+
+    def test_car_delete_invalidates(self):
+        build_series(self.user, group='car')
+        self.car.delete()
+        self.assertEqual(build_series(self.user, group='car')['series'][0]['name'], 'Unassigned')
+
+    def test_admin_recompute_invalidates(self):
+        fuel = FuelType.objects.create(user=self.user, name='Petrol', cost_per_unit=3, efficiency=10)
+        Journey.objects.filter(user=self.user).update(fuel_type_ref=fuel)
+        self.assertEqual(build_series(self.user, metric='cost')['series'][0]['points'][0][1], 60.0)
+        self.client.force_login(User.objects.create_superuser('admin'))
+        self.client.post(reverse('admin:tracker_journey_changelist'), {
+            'action': 'recompute_totals',
+            '_selected_action': list(Journey.objects.values_list('pk', flat=True)),
+        })
+        self.assertEqual(build_series(self.user, metric='cost')['series'][0]['points'][0][1], 90.0)
+
+    def test_other_users_cache_is_untouched(self):
+        other = User.objects.create_user('other')
+        build_series(other)
+        build_series(self.user)
+        Journey.objects.filter(user=self.user).first().delete()
+        with CaptureQueriesContext(connection) as queries:
+            build_series(other)
+        self.assertEqual(len(queries), 0)
+
+
+@override_settings(STORAGES=TEST_STORAGES, CACHES=TEST_CACHES)
+class JourneyAdminTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', password='pw')
+        self.fuel = FuelType.objects.create(user=self.admin, name='Petrol', cost_per_unit=2, efficiency=10)
+        self.changelist = reverse('admin:tracker_journey_changelist')
+        self.client.force_login(self.admin)
+
+    def add_journeys(self, *dates, **fields):
+        return [
+            Journey.objects.create(
+                user=fields.get('user', self.admin), date=date, distance=50, reason='Commute', fuel_type='Petrol',
+                fuel_type_ref=self.fuel, cost_per_liter=2, fuel_quantity=5, total_cost=10,
+            )
+            for date in dates
+        ]
+
+    def test_unfiltered_count_is_estimated_from_the_highest_id(self):
+        journeys = self.add_journeys(*[datetime.date(2024, 5, day) for day in range(1, 6)])
+        journeys[1].delete()
+        paginator = EstimatedCountPaginator(Journey.objects.order_by('pk'), 50)
+        with self.assertNumQueries(1):
+            self.assertEqual(paginator.count, journeys[-1].pk)
+        self.assertEqual(EstimatedCountPaginator(Journey.objects.order_by('pk').none(), 50).count, 0)
+
+    def test_filtered_count_is_capped(self):
+        self.add_journeys(*[datetime.date(2024, 5, day) for day in range(1, 6)])
+        queryset = Journey.objects.filter(distance=50).order_by('pk')
+        self.assertEqual(EstimatedCountPaginator(queryset, 50).count, 5)
+        with mock.patch.object(EstimatedCountPaginator, 'COUNT_LIMIT', 3):
+            self.assertEqual(EstimatedCountPaginator(queryset, 50).count, 3)
+
+    def test_year_filter_lists_the_range_and_filters_on_dates(self):
+        self.add_journeys(
+            datetime.date(2021, 12, 31), datetime.date(2023, 1, 1), datetime.date(2023, 12, 31), datetime.date(2024, 1, 1),
+        )
+        response = self.client.get(self.changelist)
+        choices = [choice['display'] for choice in response.context['cl'].filter_specs[0].choices(response.context['cl'])]
+        self.assertEqual(choices, ['All', '2024', '2023', '2022', '2021'])
+
+        cl = self.client.get(self.changelist, {'year': '2023'}).context['cl']
+        self.assertEqual(sorted(str(journey.date) for journey in cl.result_list), ['2023-01-01', '2023-12-31'])
+        # A plain range on the indexed column, not a per-row date function
+        self.assertIn('"date" >= 2023-01-01 AND "tracker_journey"."date" < 2024-01-01', str(cl.queryset.query))
+        # Unusable years are ignored rather than failing the page
+        for year in ('abc', '99999'):
+            self.assertEqual(len(self.client.get(self.changelist, {'year': year}).context['cl'].result_list), 4)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self.add_journeys(datetime.date(2024, 5, 1))
+        for index in range(10):
+            user = User.objects.create_user(f'driver{index}')
+            car = Car.objects.create(user=user, name=f'Car {index}')
+            Journey.objects.filter(pk=self.add_journeys(datetime.date(2024, 5, 2), user=user)[0].pk).update(car=car)
+        # Session, user, year MIN and MAX, MAX(id) for the count, the page
+        # with users and cars joined, and the settings context processor
+        with self.assertNumQueries(7):
+            self.assertEqual(self.client.get(self.changelist).status_code, 200)
+
+    def recompute(self, journeys):
+        return self.client.post(self.changelist, {
+            'action': 'recompute_totals', '_selected_action': [journey.pk for journey in journeys],
+        })
+
+    def test_recompute_totals_uses_the_current_fuel_price(self):
+        journeys = self.add_journeys(datetime.date(2024, 5, 1), datetime.date(2024, 5, 2))
+        untouched = self.add_journeys(datetime.date(2024, 5, 3))[0]
+        FuelType.objects.filter(pk=self.fuel.pk).update(cost_per_unit=Decimal('2.5'))
+        response = self.recompute(journeys)
+        self.assertRedirects(response, self.changelist)
+        self.assertEqual(
+            list(Journey.objects.filter(pk__in=[journey.pk for journey in journeys]).values_list('cost_per_liter', 'total_cost')),
+            [(Decimal('2.5'), Decimal('12.5'))] * 2,
+        )
+        untouched.refresh_from_db()
+        self.assertEqual(untouched.total_cost, 10)
+
+    def test_recompute_totals_needs_change_permission(self):
+        journey = self.add_journeys(datetime.date(2024, 5, 1))[0]
+        FuelType.objects.filter(pk=self.fuel.pk).update(cost_per_unit=3)
+        viewer = User.objects.create_user('viewer', password='pw', is_staff=True)
+        viewer.user_permissions.add(Permission.objects.get(codename='view_journey'))
+        self.client.force_login(viewer)
+        self.recompute([journey])
+        journey.refresh_from_db()
+        self.assertEqual(journey.total_cost, 10)
+
+
+SHARDED_MIDDLEWARE = list(settings.MIDDLEWARE)
+SHARDED_MIDDLEWARE.insert(
+    SHARDED_MIDDLEWARE.index('django.contrib.auth.middleware.AuthenticationMiddleware') + 1,
+    'tracker.middleware.ShardMiddleware',
+)
+
+
+@override_settings(
+    STORAGES=TEST_STORAGES, CACHES=TEST_CACHES, SHARD_COUNT=2,
+    DATABASE_ROUTERS=['tracker.routers.ShardRouter'], MIDDLEWARE=SHARDED_MIDDLEWARE,
+)
+@mock.patch('tracker.management.commands.rebalance_shards.SETTLE_SECONDS', 0)
+class ShardingTests(TestCase):
+    databases = {'default', 'shard_0', 'shard_1'}
+
+    def setUp(self):
+        self.user = User.objects.create_user('driver', password='pw')
+        ShardAssignment.objects.create(user=self.user, shard=0)
+        # Rows of another user on shard_1, so copied rows get different ids there
+        other = User.objects.create_user('other')
+        ShardAssignment.objects.create(user=other, shard=1)
+        with shards.use_shard(other):
+            FuelType.objects.create(user=other, name='Diesel', cost_per_unit=2, efficiency=10)
+            Car.objects.create(user=other, name='Van')
+
+        with shards.use_shard(self.user):
+            self.fuel = FuelType.objects.create(user=self.user, name='Petrol', cost_per_unit=2, efficiency=10)
+            self.car = Car.objects.create(user=self.user, name='Panda', fuel_type=self.fuel)
+            Settings.objects.create(user=self.user, default_fuel_type=self.fuel)
+            self.journey = Journey.objects.create(
+                user=self.user, car=self.car, fuel_type_ref=self.fuel, date=datetime.date(2024, 5, 1), distance=10,
+                reason='Commute', fuel_type='Petrol', cost_per_liter=2, fuel_quantity=1, total_cost=2,
+            )
+            self.created_at = datetime.datetime(2024, 5, 1, 8, tzinfo=datetime.timezone.utc)
+            Journey.objects.filter(pk=self.journey.pk).update(created_at=self.created_at)
+
+    def rebalance(self, *args):
+        out = StringIO()
+        call_command('rebalance_shards', *args, stdout=out)
+        return out.getvalue()
+
+    def rows(self, db, user=None):
+        user = user or self.user
+        return [model.objects.using(db).filter(user=user).count() for model in (Journey, Car, Settings, FuelType)]
+
+    def test_router_sends_tracker_rows_to_the_users_shard(self):
+        self.assertEqual(self.journey._state.db, 'shard_0')
+        # Outside a shard context the instance's user decides
+        journey = Journey(
+            user=self.user, date=datetime.date(2024, 5, 2), distance=5, reason='Errand',
+            fuel_type='Petrol', cost_per_liter=2, fuel_quantity=1, total_cost=2,
+        )
+        journey.save()
+        self.assertEqual(journey._state.db, 'shard_0')
+        with shards.use_shard(self.user):
+            self.assertEqual(Journey.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(self.rows('shard_0'), [2, 1, 1, 1])
+        self.assertEqual(self.rows('shard_1'), [0, 0, 0, 0])
+        self.assertEqual(self.rows('default'), [0, 0, 0, 0])
+
+    def test_requests_use_the_users_shard(self):
+        ShardAssignment.objects.filter(user=self.user).update(shard=1)
+        fuel = FuelType.objects.using('shard_1').create(user=self.user, name='Petrol', cost_per_unit=2, efficiency=10)
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('add_journey'), {
+            'fuel_type_select': str(fuel.pk), 'date': '2024-05-02', 'distance': '20', 'reason': 'Visit',
+        })
+        self.assertRedirects(response, reverse('dashboard'))
+        self.assertEqual(Journey.objects.using('shard_1').get(user=self.user).distance, 20)
+
+    def test_moving_user_is_asked_to_retry(self):
+        ShardAssignment.objects.filter(user=self.user).update(moving=True)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '30')
+
+    def test_admin_shard_is_chosen_per_session(self):
+        admin = User.objects.create_superuser('admin', password='pw')
+        self.client.force_login(admin)
+        changelist = reverse('admin:tracker_journey_changelist')
+        response = self.client.get(changelist, {'_shard': '1'})
+        self.assertRedirects(response, changelist)
+        self.assertEqual(self.client.session[ADMIN_SHARD_SESSION_KEY], 1)
+        self.assertEqual(self.client.get(changelist).context['cl'].result_count, 0)
+
+        # Out of range falls back to the first shard
+        self.client.get(changelist, {'_shard': '7'})
+        self.assertEqual(self.client.session[ADMIN_SHARD_SESSION_KEY], 0)
+        self.assertEqual(self.client.get(changelist).context['cl'].result_count, 1)
+
+    def test_refuses_to_start_with_users_on_removed_shards(self):
+        with override_settings(SHARD_COUNT=1):
+            with self.assertRaisesMessage(ImproperlyConfigured, '--from-count 2'):
+                ShardMiddleware(lambda request: None)
+            ShardAssignment.objects.filter(shard=1).update(shard=0)
+            ShardMiddleware(lambda request: None)
+
+    def test_rebalance_copies_rows_and_remaps_foreign_keys(self):
+        out = self.rebalance('driver', '--to', '1')
+        self.assertIn('driver: shard_0 -> shard_1 (1 journeys)', out)
+        self.assertEqual(self.rows('shard_0'), [0, 0, 0, 0])
+        self.assertEqual(self.rows('shard_1'), [1, 1, 1, 1])
+
+        journey = Journey.objects.using('shard_1').get(user=self.user)
+        fuel = FuelType.objects.using('shard_1').get(user=self.user)
+        self.assertNotEqual(fuel.pk, self.fuel.pk)
+        self.assertEqual((journey.car.name, journey.car.fuel_type_id), ('Panda', fuel.pk))
+        self.assertEqual(journey.fuel_type_ref_id, fuel.pk)
+        self.assertEqual(Settings.objects.using('shard_1').get(user=self.user).default_fuel_type_id, fuel.pk)
+        self.assertEqual(journey.created_at, self.created_at)
+
+        assignment = ShardAssignment.objects.get(user=self.user)
+        self.assertEqual((assignment.shard, assignment.moving), (1, False))
+
+    def test_writes_queued_behind_the_lock_are_merged(self):
+        move_user = Command.move_user
+
+        def move_then_write(command, assignment, source, target_index):
+            copied = move_user(command, assignment, source, target_index)
+            # A request that was waiting on the source lock writes there once it is released
+            Journey.objects.using(source).create(
+                user=self.user, date=datetime.date(2024, 5, 2), distance=5, reason='Late',
+                fuel_type='Petrol', cost_per_liter=2, fuel_quantity=1, total_cost=2,
+            )
+            return copied
+
+        with mock.patch.object(Command, 'move_user', move_then_write):
+            out = self.rebalance('driver', '--to', '1')
+        self.assertIn('shard_0 -> shard_1: merged 1 late journeys', out)
+        self.assertEqual(self.rows('shard_0'), [0, 0, 0, 0])
+        self.assertEqual(
+            sorted(Journey.objects.using('shard_1').filter(user=self.user).values_list('reason', flat=True)),
+            ['Commute', 'Late'],
+        )
+
+    def test_from_default_merges_the_live_shard_into_the_target(self):
+        Journey.objects.using('default').create(
+            user=self.user, date=datetime.date(2023, 1, 1), distance=5, reason='Legacy',
+            fuel_type='Petrol', cost_per_liter=2, fuel_quantity=1, total_cost=2,
+        )
+        self.rebalance('driver', '--from-default', '--to', '1')
+        self.assertEqual(self.rows('default'), [0, 0, 0, 0])
+        self.assertEqual(self.rows('shard_0'), [0, 0, 0, 0])
+        self.assertEqual(
+            sorted(Journey.objects.using('shard_1').filter(user=self.user).values_list('reason', flat=True)),
+            ['Commute', 'Legacy'],
+        )
+        self.assertEqual(ShardAssignment.objects.get(user=self.user).shard, 1)
+
+    def test_from_count_moves_users_off_removed_shards(self):
+        ShardAssignment.objects.filter(user=self.user).update(shard=1)
+        for model in (Journey, Car, Settings, FuelType):
+            model.objects.using('shard_0').filter(user=self.user).delete()
+        Journey.objects.using('shard_1').create(
+            user=self.user, date=datetime.date(2024, 5, 1), distance=10, reason='Commute',
+            fuel_type='Petrol', cost_per_liter=2, fuel_quantity=1, total_cost=2,
+        )
+        with override_settings(SHARD_COUNT=1):
+            with self.assertRaisesMessage(CommandError, '--from-count 2'):
+                self.rebalance('--all')
+            self.rebalance('--all', '--from-count', '2')
+        self.assertEqual(ShardAssignment.objects.get(user=self.user).shard, 0)
+        self.assertEqual(self.rows('shard_0'), [1, 0, 0, 0])
+        self.assertEqual(Journey.objects.using('shard_1').filter(user=self.user).count(), 0)
+
+    def test_deleting_a_user_deletes_their_shard_data(self):
+        self.user.delete()
+        self.assertEqual(self.rows('shard_0', self.journey.user_id), [0, 0, 0, 0])
+        self.assertEqual(Car.objects.using('shard_1').count(), 1)
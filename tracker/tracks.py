@@ -0,0 +1,234 @@
+"""
+Streaming GPS track parsing for journey imports.
+
+GPX and CSV tracks are read chunk by chunk, so memory stays flat however many
+points a track has. Points are simplified on the fly (anything closer than
+min_step metres to the last kept point is GPS jitter and dropped) and the
+kept points are measured with haversine in fixed-size batches, vectorized
+with NumPy when it is installed.
+"""
+import codecs
+import csv
+import datetime
+import math
+from xml.parsers import expat
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EARTH_RADIUS_KM = 6371.0088
+DEG_TO_RAD = math.pi / 180
+# Points kept in memory before their distances are computed
+BATCH_SIZE = 8192
+# Default simplification tolerance in metres
+MIN_STEP_METERS = 10
+
+LAT_COLUMNS = ('lat', 'latitude')
+LON_COLUMNS = ('lon', 'lng', 'long', 'longitude')
+TIME_COLUMNS = ('time', 'timestamp', 'datetime')
+
+
+def _haversine_python(lats, lons):
+    sin, cos, asin, sqrt = math.sin, math.cos, math.asin, math.sqrt
+    total = 0.0
+    lat1, lon1 = lats[0], lons[0]
+    cos1 = cos(lat1)
+    for lat2, lon2 in zip(lats[1:], lons[1:]):
+        cos2 = cos(lat2)
+        a = sin((lat2 - lat1) / 2) ** 2 + cos1 * cos2 * sin((lon2 - lon1) / 2) ** 2
+        total += asin(sqrt(min(a, 1.0)))
+        lat1, lon1, cos1 = lat2, lon2, cos2
+    return 2 * EARTH_RADIUS_KM * total
+
+
+def _haversine_numpy(lats, lons):
+    lat = np.frombuffer(lats, dtype=np.float64)
+    lon = np.frombuffer(lons, dtype=np.float64)
+    a = (np.sin(np.diff(lat) / 2) ** 2
+         + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * float(np.arcsin(np.sqrt(np.minimum(a, 1.0))).sum())
+
+
+class TrackSummary:
+    """
+    Accumulates a track point by point and exposes its total distance.
+
+    Only the current batch of kept points is held in memory.
+    """
+
+    def __init__(self, min_step=MIN_STEP_METERS, vectorized=None):
+        if vectorized is None:
+            vectorized = np is not None
+        if vectorized and np is None:
+            raise ValueError("NumPy is not installed")
+        self._haversine = _haversine_numpy if vectorized else _haversine_python
+        self._min_step = (min_step / 1000.0 / EARTH_RADIUS_KM) ** 2
+        self._lats = array('d')
+        self._lons = array('d')
+        self._last = None
+        self._cos_lat = 1.0
+        self._distance = 0.0
+        self.points = 0
+        self.kept_points = 0
+        self.started_at = None
+
+    def add(self, lat, lon, timestamp=None):
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError(f"Invalid coordinate ({lat}, {lon})")
+        self.points += 1
+        if timestamp is not None and self.started_at is None:
+            self.started_at = timestamp
+
+        lat = lat * DEG_TO_RAD
+        lon = lon * DEG_TO_RAD
+        last = self._last
+        if last is None:
+            self._cos_lat = math.cos(lat)
+        else:
+            # Equirectangular approximation is plenty for a few-metre tolerance
+            dx = (lon - last[1]) * self._cos_lat
+            dy = lat - last[0]
+            if dx * dx + dy * dy < self._min_step:
+                return
+        self._last = (lat, lon)
+        self._lats.append(lat)
+        self._lons.append(lon)
+        self.kept_points += 1
+        if len(self._lats) >= BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if len(self._lats) > 1:
+            self._distance += self._haversine(self._lats, self._lons)
+        # Carry the last point over so the next batch joins up with this one
+        self._lats = self._lats[-1:]
+        self._lons = self._lons[-1:]
+
+    @property
+    def distance(self):
+        """Total distance in kilometres."""
+        self._flush()
+        return self._distance
+
+
+def _parse_time(value):
+    if not value:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value.strip())
+    except ValueError:
+        return None
+
+
+def _local_name(tag):
+    return tag.rpartition(':')[2]
+
+
+def parse_gpx(chunks, summary):
+    # expat is fed block by block and never builds a tree, so a track costs
+    # the same memory at 100 points as at 100k
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    add = summary.add
+    text = []
+
+    def point(name, attrs):
+        if name == 'trkpt' or name.endswith(':trkpt'):
+            add(float(attrs['lat']), float(attrs['lon']))
+
+    # Until a timestamp has been seen, also watch for the first <time>
+    def point_or_time(name, attrs):
+        if _local_name(name) == 'time':
+            parser.CharacterDataHandler = text.append
+            parser.EndElementHandler = end_time
+        else:
+            point(name, attrs)
+
+    def end_time(name):
+        summary.started_at = _parse_time(''.join(text))
+        parser.CharacterDataHandler = None
+        parser.EndElementHandler = None
+        parser.StartElementHandler = point
+
+    parser.StartElementHandler = point_or_time
+    for chunk in chunks:
+        parser.Parse(chunk, False)
+    parser.Parse(b'', True)
+    return summary
+
+
+def _iter_lines(chunks):
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    pending = ''
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.split('\n')
+        pending = lines.pop()
+        yield from lines
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def _find_column(header, names):
+    for index, column in enumerate(header):
+        if column.strip().lower() in names:
+            return index
+    return None
+
+
+def parse_csv(chunks, summary):
+    reader = csv.reader(_iter_lines(chunks))
+    header = next(reader, None) or []
+    lat_col = _find_column(header, LAT_COLUMNS)
+    lon_col = _find_column(header, LON_COLUMNS)
+    time_col = _find_column(header, TIME_COLUMNS)
+    if lat_col is None or lon_col is None:
+        raise ValueError("CSV track needs latitude and longitude columns")
+
+    for row in reader:
+        if not row:
+            continue
+        timestamp = None
+        if summary.started_at is None and time_col is not None:
+            timestamp = _parse_time(row[time_col])
+        summary.add(float(row[lat_col]), float(row[lon_col]), timestamp)
+    return summary
+
+
+def parse_track(track, **kwargs):
+    """
+    Parse an uploaded GPX or CSV track and return its TrackSummary.
+
+    `track` is any Django File; the format is picked from its extension and
+    falls back to sniffing the first bytes. Raises ValueError on bad input.
+    """
+    summary = TrackSummary(**kwargs)
+    chunks = track.chunks()
+    first = next(chunks, b'')
+    name = (getattr(track, 'name', '') or '').lower()
+
+    def stream():
+        yield first
+        yield from chunks
+
+    if name.endswith('.gpx') or (not name.endswith('.csv') and first.lstrip().startswith(b'<')):
+        try:
+            parse_gpx(stream(), summary)
+        except (expat.ExpatError, KeyError) as e:
+            raise ValueError(f"Invalid GPX file: {e}")
+    else:
+        try:
+            parse_csv(stream(), summary)
+        except (IndexError, csv.Error) as e:
+            raise ValueError(f"Invalid CSV file: {e}")
+
+    if summary.points < 2:
+        raise ValueError("Track has fewer than two points")
+    # Journeys store kilometres to two decimals
+    if round(summary.distance, 2) <= 0:
+        raise ValueError("Track covers no distance; all of its points are at the same spot")
+    return summary
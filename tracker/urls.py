@@ -4,6 +4,7 @@ from . import views
 urlpatterns = [
     path('', views.dashboard, name='dashboard'),
     path('add/', views.add_journey, name='add_journey'),
+    path('import-track/', views.import_track, name='import_track'),
     path('edit-journey/<int:journey_id>/', views.edit_journey, name='edit_journey'),
     path('delete-journey/<int:journey_id>/', views.delete_journey, name='delete_journey'),
     path('history/', views.history_view, name='history'),
@@ -11,4 +12,9 @@ urlpatterns = [
     path('settings/', views.settings_view, name='settings'),
     path('edit-fuel/<int:fuel_id>/', views.edit_fuel, name='edit_fuel'),
     path('delete-fuel/<int:fuel_id>/', views.delete_fuel, name='delete_fuel'),
+    path('offline/', views.offline_view, name='offline'),
+    path('api/journeys/sync/', views.sync_journeys, name='sync_journeys'),
+    path('api/series/', views.series_api, name='series_api'),
+    path('sw.js', views.service_worker, name='service_worker'),
+    path('manifest.webmanifest', views.web_manifest, name='web_manifest'),
 ]
@@ -1,11 +1,21 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.http import JsonResponse
+from django.views.decorators.http import require_POST
+from django.db import IntegrityError, router, transaction
 from django.db.models import Sum, Q, F, Count
 from django.db.models.functions import TruncMonth
 from django.utils import timezone
 from django.contrib.auth.decorators import login_required
+from django.utils.translation import gettext as _
 from .models import Journey, Settings, FuelType, Car
-from .forms import JourneyForm, SettingsForm, FuelTypeForm, CarForm
+from .forms import JourneyForm, SettingsForm, FuelTypeForm, CarForm, TrackImportForm
+from . import series
 import datetime
+import json
+import uuid
+
+# Upper bound on journeys accepted in a single offline sync request
+SYNC_BATCH_LIMIT = 100
 
 @login_required
 def dashboard(request):
@@ -37,11 +47,26 @@ def add_journey(request):
     settings, created = Settings.objects.get_or_create(user=request.user)
     
     if request.method == 'POST':
+        # Idempotency key set by the page, so a retried submit is stored only once
+        try:
+            client_uuid = uuid.UUID(request.POST.get('client_uuid', ''))
+        except ValueError:
+            client_uuid = None
+        if client_uuid and Journey.objects.filter(user=request.user, client_uuid=client_uuid).exists():
+            return redirect('dashboard')
+
         form = JourneyForm(request.user, request.POST)
         if form.is_valid():
             journey = form.save(commit=False)
             journey.user = request.user
-            journey.save()
+            journey.client_uuid = client_uuid
+            try:
+                with transaction.atomic(using=router.db_for_write(Journey, instance=journey)):
+                    journey.save()
+            except IntegrityError:
+                # Only a concurrent retry of the same submit counts as saved
+                if not client_uuid or not Journey.objects.filter(user=request.user, client_uuid=client_uuid).exists():
+                    raise
             return redirect('dashboard')
     else:
         # Get defaults
@@ -54,8 +79,29 @@ def add_journey(request):
             'date': timezone.now().date()
         }
         form = JourneyForm(request.user, initial=initial_data)
+        client_uuid = None
+
+    return render(request, 'tracker/add_journey.html', {'form': form, 'client_uuid': client_uuid})
 
-    return render(request, 'tracker/add_journey.html', {'form': form})
+@login_required
+def import_track(request):
+    settings, created = Settings.objects.get_or_create(user=request.user)
+
+    if request.method == 'POST':
+        form = TrackImportForm(request.user, request.POST, request.FILES)
+        if form.is_valid():
+            journey = form.save(commit=False)
+            journey.user = request.user
+            journey.save()
+            return redirect('dashboard')
+    else:
+        default_fuel = settings.default_fuel_type
+        form = TrackImportForm(request.user, initial={
+            'fuel_type_select': default_fuel,
+            'cost_per_liter': default_fuel.cost_per_unit if default_fuel else 0,
+        })
+
+    return render(request, 'tracker/import_track.html', {'form': form})
 
 from django.utils import translation
 
@@ -186,6 +232,30 @@ def reports_view(request):
             .order_by('-month')
     }
     return render(request, 'tracker/reports.html', context)
+def series_api(request):
+    """
+    JSON time series for the reports chart, e.g.
+    ?granularity=week&metric=cost_per_km&group=car&points=300
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'authentication required'}, status=401)
+
+    granularity = request.GET.get('granularity', 'month')
+    metric = request.GET.get('metric', 'distance')
+    group = request.GET.get('group', 'none')
+    if granularity not in series.GRANULARITIES or metric not in series.METRICS or group not in series.GROUPS:
+        return JsonResponse({'error': 'invalid granularity, metric or group'}, status=400)
+
+    try:
+        points = int(request.GET.get('points', series.DEFAULT_POINTS))
+        start = datetime.date.fromisoformat(request.GET['start']) if request.GET.get('start') else None
+        end = datetime.date.fromisoformat(request.GET['end']) if request.GET.get('end') else None
+    except ValueError:
+        return JsonResponse({'error': 'invalid points, start or end'}, status=400)
+    points = max(series.MIN_POINTS, min(series.MAX_POINTS, points))
+
+    return JsonResponse(series.build_series(request.user, granularity, metric, group, points, start, end))
+
 @login_required
 def delete_journey(request, journey_id):
     journey = get_object_or_404(Journey, pk=journey_id, user=request.user)
@@ -216,3 +286,71 @@ def delete_fuel(request, fuel_id):
         return redirect('settings')
     return render(request, 'tracker/confirm_delete.html', {'object': fuel, 'type': 'Fuel Type'})
 
+
+def service_worker(request):
+    # Served from the site root so the worker's scope covers every page
+    response = render(request, 'tracker/sw.js', content_type='application/javascript')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+def web_manifest(request):
+    return render(request, 'tracker/manifest.webmanifest', content_type='application/manifest+json')
+
+def offline_view(request):
+    return render(request, 'tracker/offline.html')
+
+@require_POST
+def sync_journeys(request):
+    """
+    Batch endpoint used by the service worker to replay journeys queued offline.
+    Each entry carries a client_uuid so a replayed request never creates duplicates.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'authentication required'}, status=401)
+
+    try:
+        payload = json.loads(request.body)
+        entries = payload['journeys']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'invalid payload'}, status=400)
+
+    if not isinstance(entries, list) or len(entries) > SYNC_BATCH_LIMIT:
+        return JsonResponse({'error': 'invalid payload'}, status=400)
+
+    results = []
+    for entry in entries:
+        try:
+            client_uuid = uuid.UUID(str(entry.get('client_uuid')))
+        except (AttributeError, ValueError):
+            results.append({'client_uuid': None, 'status': 'invalid', 'errors': {'client_uuid': ['missing or malformed']}})
+            continue
+
+        existing = Journey.objects.filter(user=request.user, client_uuid=client_uuid).values_list('id', flat=True).first()
+        if existing:
+            results.append({'client_uuid': str(client_uuid), 'status': 'duplicate', 'id': existing})
+            continue
+
+        form = JourneyForm(request.user, entry)
+        if not form.is_valid():
+            results.append({'client_uuid': str(client_uuid), 'status': 'invalid', 'errors': form.errors.get_json_data()})
+            continue
+
+        journey = form.save(commit=False)
+        journey.user = request.user
+        journey.client_uuid = client_uuid
+        try:
+            with transaction.atomic(using=router.db_for_write(Journey, instance=journey)):
+                journey.save()
+        except IntegrityError:
+            existing = Journey.objects.filter(user=request.user, client_uuid=client_uuid).values_list('id', flat=True).first()
+            if existing is None:
+                # Not a duplicate, so the entry must stay queued with the reason
+                errors = {'__all__': [{'message': str(_("This journey could not be saved.")), 'code': 'integrity'}]}
+                results.append({'client_uuid': str(client_uuid), 'status': 'invalid', 'errors': errors})
+                continue
+            # A concurrent replay of the same entry won the race
+            results.append({'client_uuid': str(client_uuid), 'status': 'duplicate', 'id': existing})
+            continue
+        results.append({'client_uuid': str(client_uuid), 'status': 'created', 'id': journey.id})
+
+    return JsonResponse({'results': results})